@@ -10,35 +10,110 @@
 # Lol check out C's BNF
 # https://cs.wmich.edu/~gupta/teaching/cs4850/sumII06/The%20syntax%20of%20C%20in%20Backus-Naur%20form.htm
 
+# Each function is lowered into the three address IR (see ir.py) and the x86
+# is made from the IR. Statements and expressions have a lower method that adds
+# their instructions to an ir.IRFunction
+# generate_code returns the code of a program or function as a string
+#
+# Given a codecache.CodeCache, Program.emit looks up each function's assembly by
+# the tokens it was parsed from and only generates code for the ones that miss
+
+import ir
+from emitter import Emitter, parse_instructions
+from regalloc import LinearScanAllocator
+
+
+def count_nodes(node):
+    # How many nodes of the tree there are from node down (without recursing)
+    count = 0
+    stack = [node]
+    while len(stack) != 0:
+        node = stack.pop()
+        count += 1
+        for value in vars(node).values():
+            if isinstance(value, NODE_TYPES):
+                stack.append(value)
+    return count
+
 
 class Program:
     def __init__(self, functions):
+        # functions can be any iterable, eg. a generator of functions as they
+        # are parsed, each one is emitted and then let go of
         self.functions = functions
 
-    def generate_code(self):
-        print(self)
-        functions_code = '\n'.join([f.generate_code() for f in self.functions])
-        return functions_code
+    def generate_code(self, cache=None):
+        code = Emitter(passes=[LinearScanAllocator()])
+        self.emit(code, cache=cache)
+        return code.getvalue()
+
+    def emit(self, code, ir_passes=None, cache=None):
+        # Add the code to an emitter, running the IR passes (an optimizer.PassManager)
+        # over each function
+        code.emit('section', '.text')
+
+        if cache is not None:
+            # The passes change the code so they are part of the key
+            settings = repr(([name for name, p in ir_passes.passes] if ir_passes is not None else None,
+                             [type(p).__name__ for p in code.passes]))
+
+        for i, f in enumerate(self.functions):
+            if i != 0:
+                code.blank() # an empty line between functions
+
+            if cache is None or f.tokens is None:
+                f.emit(code, ir_passes)
+                continue
+
+            with code.timer.phase('code cache'):
+                key = cache.key(f.tokens, settings)
+                text = cache.get(key)
+            if text is None:
+                # Generate the function on its own so its text can be stored
+                fragment = Emitter(passes=code.passes, timer=code.timer)
+                f.emit(fragment, ir_passes)
+                text = fragment.getvalue()
+                with code.timer.phase('code cache'):
+                    cache.put(key, text)
+
+            code.flush_pending()
+            code.write(text)
+            if code.instructions is not None:
+                code.instructions.extend(parse_instructions(text))
+
+        code.flush()
 
 
 class Function:
-    def __init__(self, id, statement):
+    def __init__(self, id, statement, tokens=None):
         self.id = id
         self.statement = statement
+        self.tokens = tokens # the tokens it was parsed from (None if unknown)
 
     def generate_code(self):
-        name = '_'+self.id + ':\n'
-        body = self.statement.generate_code()
-        return name+body
+        code = Emitter(passes=[LinearScanAllocator()])
+        self.emit(code)
+        return code.getvalue()
+
+    def lower(self):
+        # Returns the IRFunction for this function
+        function = ir.IRFunction(self.id)
+        self.statement.lower(function)
+        return function
+
+    def emit(self, code, ir_passes=None):
+        function = self.lower()
+        if ir_passes is not None:
+            function = ir_passes.run_function(function)
+        ir.emit_function(function, code)
 
 
 class Statement:
     def __init__(self, expression):
         self.expression = expression
 
-    def generate_code(self):
-        code = self.expression.generate_code('eax') + '\n\tret'
-        return code
+    def lower(self, function):
+        function.ret(self.expression.lower(function))
 
 
 # <exp> ::= <unary_op_exp> | <int>
@@ -49,21 +124,30 @@ class UnaryOpExpression():
         self.unary_op = unary_op
         self.expression = expression
 
-    def generate_code(self, register):
-        code = self.expression.generate_code(register)+'\tOPY '+register
-        return code
+    def lower(self, function):
+        # Walk down the chain of unary operators (without recursing) to the
+        # expression at the bottom, lower it and then each operator on the way back up
+        operators = []
+        expression = self
+        while isinstance(expression, UnaryOpExpression):
+            operators.append(expression.unary_op)
+            expression = expression.expression
+
+        temp = expression.lower(function)
+        for unary_op in reversed(operators):
+            temp = unary_op.lower(function, temp)
+        return temp
 
     def __str__(self):
-        pass
+        return str(self.unary_op)+'('+str(self.expression)+')'
 
 class Integer():
     # <int> ::= value
     def __init__(self, value):
         self.value = value
 
-    def generate_code(self, register):
-        code = '\tmov '+register+', '+self.value+'\n'
-        return code
+    def lower(self, function):
+        return function.const(int(self.value))
 
     def __str__(self):
         return self.value
@@ -76,5 +160,13 @@ class UnaryOp:
     def __init__(self, operation):
         self.operation = operation
 
+    def lower(self, function, temp):
+        # Apply the operation to a temporary
+        assert self.operation in ir.UNARY_OPERATIONS, 'Unknown unary operator '+repr(self.operation)
+        return function.unary(ir.UNARY_OPERATIONS[self.operation], temp)
+
     def __str__(self):
         return 'UNARYOP('+self.operation+')'
+
+
+NODE_TYPES = (Program, Function, Statement, UnaryOpExpression, Integer, UnaryOp)
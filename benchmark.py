@@ -0,0 +1,200 @@
+############################################### Benchmark.py ################################################
+
+# Times each phase of the compiler on synthetic programs of growing size
+#
+# Usage: benchmark.py [--functions N,N,..] [--depth N] [--id-length N] [--repeat N]
+#                     [--save FILE] [--compare FILE] [--threshold F]
+#
+# A program is made of --functions functions like
+#     int qzkfr(){return -~!-~!~-43;}
+# with --depth unary operators in each expression and names --id-length
+# letters long. For every size each phase is run --repeat times and the best
+# time is kept
+#
+# --> lexer tables   building the minimal DFA from lexer.language (once, it doesn't
+#                    depend on the program)
+# --> gettokens      the original character by character tokenizer
+# --> scan           the table driven scanner (tokenize.readtokens)
+# --> parse          the parser on tokens that have already been scanned
+# --> codegen        optimizing and generating the assembly (in memory, no code cache)
+# --> object         encoding the instructions into an ELF object (elf.assemble)
+#
+# The throughput of a phase is source bytes per second (lexer tables per
+# second for the lexer tables). --save writes the results to a JSON file and
+# --compare checks them against one made with the same settings, exiting with 1
+# if any throughput is more than --threshold (a fraction, default 0.2) below it
+
+import sys, os, gc, json, random, time, tempfile
+
+import lexer, tokenize, parsers, compiler, elf
+
+#-----------------------------------------------------------------------------------------------------------#
+
+# Synthetic programs
+
+KEYWORDS = ('int', 'void', 'return')
+
+
+def generate_name(rng, length, used):
+    # A random name of letters that isn't a keyword, main or already in the set
+    # used (it is added to used)
+    letters = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    reserved = len([name for name in KEYWORDS + ('main',) if len(name) == length])
+    assert len(used) + reserved < len(letters) ** length, \
+        'Not enough names '+str(length)+' letters long'
+    while True:
+        name = ''.join(rng.choice(letters) for _ in range(length))
+        if not name in KEYWORDS and name != 'main' and not name in used:
+            used.add(name)
+            return name
+
+
+def generate_program(n_functions, depth, id_length, seed=0):
+    # The source of a program in the supported grammar, the last function is main
+    rng = random.Random(seed)
+    used = set()
+    lines = []
+    for i in range(n_functions):
+        name = 'main' if i == n_functions - 1 else generate_name(rng, id_length, used)
+        operators = ''.join(rng.choice('!~-') for _ in range(depth))
+        lines.append('int ' + name + '(){return ' + operators + str(rng.randint(0, 999)) + ';}\n')
+    return ''.join(lines)
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+# Timing
+
+
+def best_time(function, repeat, setup=None):
+    # The shortest time out of repeat calls of function (and its last result),
+    # if there is a setup function it is called (untimed) before each call and
+    # what it returns is passed to function. Like timeit the garbage collector
+    # is kept off while timing so a collection doesn't land in one phase
+    best = None
+    for _ in range(repeat):
+        argument = setup() if setup is not None else None
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            result = function() if setup is None else function(argument)
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def time_phases(filename, repeat):
+    # {phase: seconds} for the program in filename
+    times = {}
+    times['gettokens'], tokens = best_time(lambda: tokenize.gettokens(filename), repeat)
+    times['scan'], stream = best_time(lambda: tokenize.readtokens(filename), repeat)
+    # The tokens are scanned before the timer starts so only parsing is timed
+    times['parse'], program = best_time(parsers.parse_program, repeat,
+                                        setup=lambda: tokenize.TokenGenerator(filename))
+
+    # The optimizer changes the tree so each run gets a new one
+    times['codegen'], code = best_time(
+        lambda tree: compiler.generate(tree, None, cache=False, keep_instructions=True), repeat,
+        setup=lambda: parsers.parse_program(tokenize.TokenGenerator(filename)))
+
+    times['object'], result = best_time(lambda: elf.assemble(code.instructions), repeat)
+    return times
+
+
+def run(sizes, depth, id_length, repeat):
+    # The results, {'settings': ..., 'phases': {name: {'seconds', 'throughput'}}}
+    # with one entry per phase and size (eg. 'parse/1000')
+    phases = {}
+
+    seconds, table = best_time(lambda: lexer.build_tables(lexer.language), repeat)
+    phases['lexer tables'] = {'seconds': seconds, 'throughput': 1 / seconds}
+
+    tokenize.getscanner() # loaded once, as in the compiler
+
+    with tempfile.TemporaryDirectory() as directory:
+        for n_functions in sizes:
+            filename = os.path.join(directory, 'bench' + str(n_functions) + '.c')
+            source = generate_program(n_functions, depth, id_length)
+            with open(filename, 'w') as f:
+                f.write(source)
+
+            for phase, seconds in time_phases(filename, repeat).items():
+                phases[phase + '/' + str(n_functions)] = {'seconds': seconds,
+                                                          'throughput': len(source) / max(seconds, 1e-9)}
+
+    return {'settings': {'functions': sizes, 'depth': depth, 'id_length': id_length},
+            'phases': phases}
+
+
+def compare(results, baseline, threshold):
+    # The phases whose throughput has fallen more than threshold below the baseline
+    for setting in ('functions', 'depth', 'id_length'):
+        assert results['settings'][setting] == baseline['settings'][setting], \
+            'The baseline was made with a different '+setting
+    missing = sorted(set(results['phases']) ^ set(baseline['phases']))
+    assert len(missing) == 0, 'Phases only in one of the results and the baseline: '+', '.join(missing)
+
+    slower = []
+    for phase, result in results['phases'].items():
+        before = baseline['phases'][phase]['throughput']
+        if result['throughput'] < before * (1 - threshold):
+            slower.append((phase, before, result['throughput']))
+    return slower
+
+
+def print_results(results, baseline=None):
+    print('%-22s %12s %16s %10s' % ('phase', 'seconds', 'throughput', 'change'))
+    for phase, result in results['phases'].items():
+        change = ''
+        if baseline is not None and phase in baseline['phases']:
+            before = baseline['phases'][phase]['throughput']
+            change = '%+.1f%%' % (100 * (result['throughput'] / before - 1))
+        print('%-22s %12.6f %16.1f %10s' % (phase, result['seconds'], result['throughput'], change))
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+
+    def option(name, default):
+        # The value after name in args (and take them both out)
+        if not name in args:
+            return default
+        i = args.index(name)
+        value = args[i+1]
+        del args[i:i+2]
+        return value
+
+    sizes = [int(n) for n in option('--functions', '100,1000,5000').split(',')]
+    depth = int(option('--depth', '8'))
+    id_length = int(option('--id-length', '8'))
+    repeat = int(option('--repeat', '5'))
+    save = option('--save', None)
+    baseline_file = option('--compare', None)
+    threshold = float(option('--threshold', '0.2'))
+    assert len(args) == 0, 'Unknown arguments '+' '.join(args)
+
+    results = run(sizes, depth, id_length, repeat)
+
+    baseline = None
+    if baseline_file is not None:
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if save is not None:
+        with open(save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if baseline is not None:
+        slower = compare(results, baseline, threshold)
+        for phase, before, after in slower:
+            print('SLOWER: %s %.1f -> %.1f' % (phase, before, after))
+        if len(slower) != 0:
+            sys.exit(1)
@@ -0,0 +1,79 @@
+################################################# Client.py #################################################
+
+# A thin client for the compile server (see server.py)
+#
+# Usage: client.py [-O0] [--no-cache] [-S] <file.c> [<file.c> ...]
+#
+# The sources are sent to the server in one batch and each rootname.asm is
+# written from its reply, then assembled and linked like compiler.py does
+# (unless -S is given). Any file the server couldn't compile has its
+# diagnostic printed instead
+#
+# Only the standard library is imported so the client starts quickly, all the
+# compiler's modules stay loaded in the server
+#
+# Requests and replies are single lines of JSON
+#   request: {"files": [{"name": "a.c", "source": "int main(){...}"}, ...],
+#             "optimize": true, "cache": true}
+#   reply:   {"results": [{"name": "a.c", "asm": "..."} or {"name": "a.c", "error": "..."}, ...]}
+
+import sys, os, json, socket
+
+#-----------------------------------------------------------------------------------------------------------#
+
+SOCKET_PATH = os.environ.get('COMPILER_SOCKET', '/tmp/compiler-' + str(os.getuid()) + '.sock')
+
+
+def request(files, optimize=True, cache=True, path=SOCKET_PATH):
+    # Sends a batch of (name, source) to the server, returns the list of results
+    message = {'files': [{'name': name, 'source': source} for name, source in files],
+               'optimize': optimize, 'cache': cache}
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        connection.sendall(json.dumps(message).encode('utf-8') + b'\n')
+        with connection.makefile('rb') as reply:
+            line = reply.readline()
+
+    assert len(line) != 0, 'The compile server closed the connection'
+    return json.loads(line)['results']
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    optimize = not '-O0' in args
+    if not optimize:
+        args.remove('-O0')
+    cache = not '--no-cache' in args
+    if not cache:
+        args.remove('--no-cache')
+    link = not '-S' in args
+    if not link:
+        args.remove('-S')
+
+    files = []
+    for filename in args:
+        with open(filename) as f:
+            files.append((filename, f.read()))
+
+    try:
+        results = request(files, optimize, cache)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print('No compile server at', SOCKET_PATH, '(start one with server.py)')
+        sys.exit(1)
+
+    failed = False
+    for result in results:
+        if 'error' in result:
+            print(result['name'] + ': ' + result['error'])
+            failed = True
+            continue
+
+        rootname = os.path.splitext(result['name'])[0]
+        with open(rootname+'.asm', 'w') as f:
+            f.write(result['asm'])
+        if link and os.system('compile '+rootname) != 0:
+            failed = True
+
+    if failed:
+        sys.exit(1)
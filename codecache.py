@@ -0,0 +1,185 @@
+############################################### CodeCache.py ################################################
+
+# A cache of the assembly made for each function so that recompiling a file
+# only generates code for the functions that have changed
+#
+# Each function's assembly is stored under a key which is the sha256 of
+# --> the version of the compiler, CODE_VERSION and a hash of the source of
+#     every file that decides what code a function gets (CODE_FILES), so
+#     changing the code generator can't reuse code made by the old one
+# --> the settings it was compiled with (which passes were run)
+# --> the tokens of the function
+# so the same function always finds its code again wherever it is in the file,
+# and any change to it (or to the compiler) simply misses
+#
+# The fragments are kept in a directory as one file per key. A fragment's
+# modification time is updated whenever it is used, when the directory grows
+# past max_bytes the least recently used fragments are deleted
+#
+# The directory is only made when the first fragment is written, if it can't
+# be (eg. a read only install) caching is turned off
+#
+# The compile server shares one cache between its threads, so the size,
+# counters and eviction are only changed holding the cache's lock. The
+# fragment files themselves are written without it (see put)
+
+import hashlib, os, tempfile, threading
+
+#-----------------------------------------------------------------------------------------------------------#
+
+# Increase this whenever the way fragments are stored changes
+CODE_VERSION = 2
+
+SOURCE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIRECTORY = os.path.join(SOURCE_DIRECTORY, 'code_cache')
+FRAGMENT_EXTENSION = '.s'
+TEMP_EXTENSION = '.tmp'
+
+# Everything between the tokens of a function and its assembly
+CODE_FILES = ['parsers.py', 'parsegen.py', 'BNR_rules.txt', 'definitions.py', 'ast.py',
+              'optimizer.py', 'ir.py', 'regalloc.py', 'peephole.py', 'emitter.py']
+
+
+_compiler_hash = None
+
+def compiler_hash():
+    # The hash of CODE_VERSION and the source of the CODE_FILES (worked out once)
+    global _compiler_hash
+    if _compiler_hash is None:
+        h = hashlib.sha256()
+        h.update(str(CODE_VERSION).encode())
+        for name in CODE_FILES:
+            with open(os.path.join(SOURCE_DIRECTORY, name), 'rb') as f:
+                h.update(b'\0' + name.encode() + b'\0' + f.read())
+        _compiler_hash = h.digest()
+    return _compiler_hash
+
+
+class CodeCache():
+
+    def __init__(self, directory=CACHE_DIRECTORY, max_bytes=1<<26):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        # Whether fragments can be written, False once making the directory failed
+        self.enabled = True
+
+        # How big the directory is, worked out at the first put (None until
+        # then) and then kept up to date
+        self.size = None
+
+        self.hits = 0
+        self.misses = 0
+
+        # Held while changing any of the above
+        self.lock = threading.Lock()
+
+    def key(self, tokens, settings=''):
+        # The key for a function from its tokens and the settings used to compile it
+        h = hashlib.sha256()
+        h.update(compiler_hash())
+        h.update(b'\0' + settings.encode('utf-8') + b'\0')
+        h.update('\0'.join(tokens).encode('utf-8'))
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + FRAGMENT_EXTENSION)
+
+    def get(self, key):
+        # The assembly stored for key, or None
+        path = self.path(key)
+        try:
+            with open(path, 'r') as f:
+                text = f.read()
+            os.utime(path) # it is now the most recently used
+        except OSError:
+            # Missing (or removed by another compiler sharing the cache)
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return text
+
+    def open(self):
+        # Make the directory and find its size the first time a fragment is
+        # written, returns False if the cache can't be written
+        with self.lock:
+            if self.size is None and self.enabled:
+                try:
+                    os.makedirs(self.directory, exist_ok=True)
+                    self.size = sum(size for path, size, used in self.fragments())
+                except OSError:
+                    self.enabled = False
+            return self.enabled
+
+    def put(self, key, text):
+        # Store the assembly for key, removing old fragments if the cache is too big
+        if not self.open():
+            return
+
+        # Write to a temporary file first so a half written fragment is never
+        # seen, each put has its own (the compile server puts from many threads)
+        try:
+            handle, temp_path = tempfile.mkstemp(TEMP_EXTENSION, key, self.directory)
+        except OSError:
+            return # Not being able to write the cache only makes the next run slower
+        try:
+            with os.fdopen(handle, 'w') as f:
+                f.write(text)
+            os.replace(temp_path, self.path(key))
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+
+        with self.lock:
+            self.size += len(text)
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def fragments(self):
+        # (path, size, last used) of every fragment in the directory, and of
+        # any temporary files (left by a compiler that was stopped while
+        # writing) so they are counted and evicted with the rest
+        fragments = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(FRAGMENT_EXTENSION) or entry.name.endswith(TEMP_EXTENSION):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                fragments.append((entry.path, stat.st_size, stat.st_mtime))
+        return fragments
+
+    def evict(self):
+        # Delete the least recently used fragments until the cache is back to
+        # three quarters of max_bytes (so it doesn't evict again on the next put)
+        # Called holding the lock
+        fragments = self.fragments()
+        fragments.sort(key=lambda fragment: fragment[2])
+        self.size = sum(size for path, size, used in fragments)
+
+        target = self.max_bytes * 3 // 4
+        for path, size, used in fragments:
+            if self.size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass # already gone
+            self.size -= size
+
+    def clear(self):
+        # Remove every fragment
+        with self.lock:
+            if not os.path.isdir(self.directory):
+                return
+            for path, size, used in self.fragments():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self.size = 0
@@ -1,19 +1,249 @@
-import sys, os
-import parsers, tokenize
+import sys, os, time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import parsers, tokenize, lexer, optimizer, peephole, regalloc, ir, codecache, elf, passtimer
+from ast import Program, count_nodes
+from emitter import Emitter
+from passtimer import NULL_TIMER
 
-filename = sys.argv[1]
-rootname = filename.split('.')[0]
+# Usage: compiler.py [--stream] [-O0] [--no-cache] [-c] [-j N] <file.c> [<file.c> ...]
+# --stream reads, parses and writes the code one function at a time
+# -O0 turns off the optimization passes (on the tree and the peephole optimizer)
+# --no-cache generates every function rather than reusing the code of
+#   functions that haven't changed since they were last compiled (see codecache.py)
+# -c writes an x86-64 ELF object (rootname.o) itself (see elf.py) rather than
+#   writing rootname.asm and running the assembler and linker
+# -j N compiles up to N files at once (default is the number of cores)
+# --time-passes prints how long each phase took and counts of the tokens, lexer
+#   states, tree nodes, ... (see passtimer.py), --time-passes=json prints them as JSON
 
 
-token_generator = tokenize.tokengenerator(filename)
-abstract_tree = parsers.parse_program(token_generator)
-code = abstract_tree.generate_code()
+# The code cache is opened the first time it is needed (once per process)
+_code_cache = None
 
+def get_code_cache():
+    global _code_cache
+    if _code_cache is None:
+        _code_cache = codecache.CodeCache()
+    return _code_cache
 
 
-with open(rootname+'.asm', 'w') as f:
-    f.write(code)
+def compile_file(filename, stream=False, optimize=True, cache=True, object_file=False, timer=NULL_TIMER):
+    # Turns one source file into rootname.asm (or rootname.o) and returns rootname
+    # timer (a passtimer.PassTimer) times each phase
+    rootname = os.path.splitext(filename)[0]
 
+    with timer.phase('lexer tables'):
+        tokenize.getscanner()
 
+    if stream:
+        # Each function is parsed, turned into code and written before the next
+        # one is read so memory use doesn't grow with the size of the file
+        # (so tokenizing is timed as part of parsing)
+        token_generator = tokenize.StreamTokenGenerator(filename)
+        abstract_tree = Program(parsers.parse_functions(token_generator))
 
-os.system('compile '+rootname)
\ No newline at end of file
+    else:
+        with timer.phase('tokenize'):
+            token_generator = tokenize.TokenGenerator(filename)
+        with timer.phase('parse'):
+            abstract_tree = parsers.parse_program(token_generator)
+
+    if timer.enabled:
+        abstract_tree = Program(counted_functions(abstract_tree.functions, timer, stream))
+
+
+    if object_file:
+        code = generate(abstract_tree, None, optimize, cache, keep_instructions=True, timer=timer)
+        with timer.phase('object file'):
+            elf.write_object(rootname+'.o', code.instructions)
+    else:
+        with open(rootname+'.asm', 'w') as f:
+            generate(abstract_tree, f, optimize, cache, timer=timer)
+
+    return rootname
+
+
+def compile_file_worker(filename, stream, optimize, cache, object_file, timed):
+    # compile_file in a worker process, returns (filename, ok, message, the
+    # results of its timer or None)
+    #
+    # Any error is caught here and sent back as a message so one bad file
+    # doesn't bring down the pool. It can't be left to the pool as formatting
+    # the traceback goes through the standard tokenize module, which this
+    # compiler's tokenize.py hides, and the worker dies
+    timer = passtimer.PassTimer() if timed else NULL_TIMER
+    try:
+        compile_file(filename, stream, optimize, cache, object_file, timer)
+    except Exception as error:
+        return filename, False, type(error).__name__+': '+str(error), None
+    return filename, True, '', timer.to_dict() if timed else None
+
+
+def counted_functions(functions, timer, stream):
+    # Yields the functions counting their tokens and nodes, when streaming
+    # getting each one is tokenizing and parsing it so that is timed as well
+    functions = iter(functions)
+    while True:
+        with timer.phase('parse' if stream else 'counting'):
+            function = next(functions, None)
+        if function is None:
+            return
+        with timer.phase('counting'):
+            timer.count('functions')
+            timer.count('tokens', len(function.tokens))
+            timer.count('AST nodes', count_nodes(function))
+        yield function
+
+
+def count_lexer(timer):
+    # Add the sizes of the lexer's automata to the counters
+    # (the NFA isn't kept once the tables are made so it is built again)
+    table = tokenize.getscanner().table
+    NFA, input_node, output_nodes = lexer.build_NFA(lexer.language)
+    timer.count('NFA nodes', NFA.size)
+    timer.count('DFA states', table.n_states)
+    timer.count('DFA transitions', sum(1 for state in table.transitions if state != -1))
+
+
+def finish_counters(timer):
+    # The counters worked out from the others
+    seconds = sum(timer.phases.get(name, [0])[0] for name in ('tokenize', 'parse'))
+    if seconds != 0:
+        timer.counters['tokens/sec'] = timer.counters.get('tokens', 0) / seconds
+
+
+def compile_source(source, optimize=True, cache=True):
+    # Returns the assembly for source text (str or bytes) held in memory
+    token_generator = tokenize.SourceTokenGenerator(source)
+    abstract_tree = parsers.parse_program(token_generator)
+    return generate(abstract_tree, None, optimize, cache).getvalue()
+
+
+def generate(abstract_tree, output, optimize=True, cache=True, keep_instructions=False, timer=NULL_TIMER):
+    # Optimizes the tree and writes its code to output (a file, or None to keep
+    # it in memory), returns the Emitter used
+    if optimize:
+        abstract_tree = optimizer.optimize(abstract_tree, timer)
+
+    passes = [regalloc.LinearScanAllocator()]
+    ir_passes = None
+    if optimize:
+        passes.append(peephole.PeepholeOptimizer())
+        ir_passes = optimizer.PassManager(ir.DEFAULT_PASSES, timer)
+    code = Emitter(output, keep_instructions=keep_instructions, passes=passes, timer=timer)
+    with timer.phase('codegen'):
+        abstract_tree.emit(code, ir_passes, get_code_cache() if cache else None)
+
+    if optimize:
+        for name, n in passes[1].hits.items():
+            timer.count('peephole: '+name, n)
+    return code
+
+
+def assemble(rootname, timer=NULL_TIMER):
+    # Assembles and links rootname.asm, returns the exit status
+    # (its CPU time is the time of the child processes)
+    wall, cpu = time.perf_counter(), passtimer.children_cpu()
+    status = os.system('compile '+rootname)
+    timer.add('assemble and link', time.perf_counter() - wall, passtimer.children_cpu() - cpu)
+    return status
+
+
+def compile_files(filenames, stream=False, optimize=True, cache=True, object_file=False, jobs=None,
+                  timer=NULL_TIMER):
+    # Compiles many files across a pool of processes
+    #
+    # The lexer tables are built (or checked) once here and saved to
+    # lexer.CACHE_FILE before the pool starts so each worker just loads them
+    # read only rather than every process building its own. As each .asm is
+    # finished it is handed to a pool of at most jobs threads that run the
+    # assembler and linker, so they overlap with the files still compiling
+    # (object files are finished as soon as they are written)
+    #
+    # The phases of every file are added up in timer, so they measure the work
+    # done rather than how long the whole build took
+    #
+    # Returns a dict of filename -> exit status of its assemble and link and a
+    # dict of filename -> error message for the files that failed to compile
+    # (the other files are still compiled)
+    jobs = jobs or os.cpu_count() or 1
+    with timer.phase('lexer tables'):
+        tokenize.getscanner()
+
+    status = {}
+    errors = {}
+    with ProcessPoolExecutor(jobs, initializer=tokenize.getscanner) as compilers, \
+         ThreadPoolExecutor(jobs) as assemblers:
+
+        compiling = [compilers.submit(compile_file_worker, filename, stream, optimize, cache,
+                                      object_file, timer.enabled)
+                     for filename in filenames]
+        assembling = {}
+        for future in as_completed(compiling):
+            filename, ok, message, results = future.result()
+            if not ok:
+                errors[filename] = message
+                continue
+            if results is not None:
+                timer.merge(results)
+            if object_file:
+                status[filename] = 0
+            else:
+                rootname = os.path.splitext(filename)[0]
+                assembling[assemblers.submit(assemble, rootname, timer)] = filename
+
+        for future in as_completed(assembling):
+            status[assembling[future]] = future.result()
+
+    return status, errors
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    stream = '--stream' in args
+    if stream:
+        args.remove('--stream')
+    optimize = not '-O0' in args
+    if not optimize:
+        args.remove('-O0')
+    cache = not '--no-cache' in args
+    if not cache:
+        args.remove('--no-cache')
+    object_file = '-c' in args
+    if object_file:
+        args.remove('-c')
+    timer = NULL_TIMER
+    report = None
+    for arg in ('--time-passes', '--time-passes=json'):
+        if arg in args:
+            args.remove(arg)
+            timer = passtimer.PassTimer()
+            report = arg
+    jobs = None
+    if '-j' in args:
+        i = args.index('-j')
+        jobs = int(args[i+1])
+        del args[i:i+2]
+
+    failed = []
+    errors = {}
+    if len(args) == 1:
+        rootname = compile_file(args[0], stream, optimize, cache, object_file, timer)
+        if not object_file and assemble(rootname, timer) != 0:
+            failed = [args[0]]
+    else:
+        status, errors = compile_files(args, stream, optimize, cache, object_file, jobs, timer)
+        failed = [filename for filename in args if status.get(filename, 0) != 0]
+        for filename in args:
+            if filename in errors:
+                print(filename+': '+errors[filename], file=sys.stderr)
+
+    if timer.enabled:
+        count_lexer(timer)
+        finish_counters(timer)
+        print(timer.report() if report == '--time-passes' else timer.to_json(), file=sys.stderr)
+
+    if len(failed) != 0:
+        print('Failed to assemble:', ' '.join(failed))
+    if len(failed) != 0 or len(errors) != 0:
+        sys.exit(1)
@@ -6,7 +6,35 @@ UNARY_OPS = ['!', '~', '-']
 KEYWORDS = ['int', 'return']
 SYMBOLS = ['(', ')', '{', '}', ';']
 
-WHITESPACE = ['\t','\n',' ']
+WHITESPACE = ['\t','\n','\r',' ']
+
+
+# The grammar symbols that are whole kinds of token from the lexer
+# (the keys of lexer.language) rather than rules of their own in BNR_rules.txt
+TOKEN_CLASSES = {'<id>': 'IDENTIFIER', '<int>': 'INTEGER'}
+
+
+# Binding powers for the expression parser (see parsers.parse_expression), the
+# higher an operator's binding power the more tightly it holds its operand
+PREFIX_BINDING_POWER = {op: 30 for op in UNARY_OPS}
+
+# Infix operators as operator -> (left binding power, right binding power),
+# a right power higher than the left makes the operator left associative
+INFIX_BINDING_POWER = {}
+
+
+# An int is 32 bits, arithmetic wraps around like two's complement C
+INT_BITS = 32
+
+def wrap_int(value):
+    # Wrap a python int around to a 32 bit two's complement int like C does
+    return (value + 2**(INT_BITS-1)) % 2**INT_BITS - 2**(INT_BITS-1)
+
+# How each unary operator changes a value, shared by the constant folding passes
+# (optimizer.py on the AST and ir.py on the IR)
+UNARY_FOLDS = {'-': lambda value: wrap_int(-value),
+               '~': lambda value: wrap_int(~value),
+               '!': lambda value: 1 if value == 0 else 0}
 
 
 # <program> ::= <function>
@@ -0,0 +1,262 @@
+################################################### Elf.py ##################################################
+
+# Writes the instructions made by the code generator (as tuples, see
+# emitter.py) straight to a relocatable ELF64 object file (.o) for x86-64
+# Linux, so no assembler has to be run
+#
+# Only the instructions the backend makes can be encoded
+# --> mov, the arithmetic group (add, or, adc, sbb, and, sub, xor, cmp) and
+#     neg, not, inc, dec on 32 bit registers, immediates and dword [reg+n]
+# --> push, pop and ret
+# --> the section .text, global and label directives
+# anything else is an error
+#
+# The code is written for 32 bit x86, running it in 64 bit mode needs a few changes
+# --> push and pop use the whole 64 bit register (there is no 32 bit push)
+# --> memory operands use the 64 bit register as the address, [esp+4] is [rsp+4]
+# --> arithmetic on esp (making room for spills) is done on rsp
+# --> the leading underscore win32 puts on C names is taken off (_main -> main)
+# 32 bit operations on the other registers are the same in 64 bit mode
+#
+# Every jump the backend could make is inside a function so nothing needs
+# relocating, the object just has .text and a symbol for each label
+
+import struct
+from bisect import bisect_right
+
+#-----------------------------------------------------------------------------------------------------------#
+
+# x86 encoding
+
+REGISTER_NUMBERS = {'eax': 0, 'ecx': 1, 'edx': 2, 'ebx': 3, 'esp': 4, 'ebp': 5, 'esi': 6, 'edi': 7}
+
+# The arithmetic group, the number is both the /digit of the immediate forms
+# (0x81 and 0x83) and 8 * it is the opcode of the register forms
+ARITHMETIC = {'add': 0, 'or': 1, 'adc': 2, 'sbb': 3, 'and': 4, 'sub': 5, 'xor': 6, 'cmp': 7}
+
+# Single operand instructions, (opcode, /digit)
+UNARY = {'not': (0xF7, 2), 'neg': (0xF7, 3), 'inc': (0xFF, 0), 'dec': (0xFF, 1)}
+
+REX_W = 0x48 # 64 bit operand size
+
+
+def is_register(operand):
+    return operand in REGISTER_NUMBERS
+
+def is_memory(operand):
+    return operand.startswith('dword')
+
+def immediate(operand):
+    # The value of an immediate operand (None if it isn't one)
+    try:
+        return int(operand, 0)
+    except ValueError:
+        return None
+
+def imm32(value):
+    return struct.pack('<I', value & 0xFFFFFFFF)
+
+def fits_imm8(value):
+    return -128 <= value <= 127
+
+
+def modrm(reg, operand):
+    # The ModRM byte (and SIB and displacement) for reg (a number or /digit)
+    # with operand as r/m
+    if is_register(operand):
+        return bytes([0xC0 | reg << 3 | REGISTER_NUMBERS[operand]])
+
+    assert is_memory(operand), 'Bad operand '+repr(operand)
+    address = operand[operand.index('[')+1:operand.index(']')].replace(' ', '')
+    for sign in '+-':
+        if sign in address:
+            base, displacement = address.split(sign)
+            displacement = int(displacement, 0) * (1 if sign == '+' else -1)
+            break
+    else:
+        base, displacement = address, 0
+    assert is_register(base), 'Bad address '+repr(operand)
+    base = REGISTER_NUMBERS[base]
+
+    # Without a displacement [ebp] would mean rip relative so it gets a 0 byte one
+    if displacement == 0 and base != 5:
+        mod, tail = 0, b''
+    elif fits_imm8(displacement):
+        mod, tail = 1, struct.pack('<b', displacement)
+    else:
+        mod, tail = 2, struct.pack('<i', displacement)
+
+    # esp as a base has to go through a SIB byte (with no index)
+    sib = b'\x24' if base == 4 else b''
+    return bytes([mod << 6 | reg << 3 | base]) + sib + tail
+
+
+def encode(instruction):
+    # The machine code for an instruction tuple
+    op, operands = instruction[0], instruction[1:]
+
+    if op == 'ret':
+        return b'\xC3'
+
+    if op in ('push', 'pop'):
+        register, = operands
+        assert is_register(register), 'Can only '+op+' a register'
+        return bytes([(0x50 if op == 'push' else 0x58) + REGISTER_NUMBERS[register]])
+
+    if op in UNARY:
+        opcode, digit = UNARY[op]
+        return bytes([opcode]) + modrm(digit, operands[0])
+
+    destination, source = operands
+    value = immediate(source)
+
+    if op == 'mov':
+        if value is not None:
+            if is_register(destination):
+                return bytes([0xB8 + REGISTER_NUMBERS[destination]]) + imm32(value)
+            return b'\xC7' + modrm(0, destination) + imm32(value)
+        if is_register(source):
+            return b'\x89' + modrm(REGISTER_NUMBERS[source], destination)
+        assert is_register(destination), 'mov can only have one memory operand'
+        return b'\x8B' + modrm(REGISTER_NUMBERS[destination], source)
+
+    if op in ARITHMETIC:
+        number = ARITHMETIC[op]
+        prefix = bytes([REX_W]) if destination == 'esp' else b'' # esp arithmetic is on rsp
+        if value is not None:
+            if fits_imm8(value):
+                return prefix + b'\x83' + modrm(number, destination) + struct.pack('<b', value)
+            if destination == 'eax':
+                return bytes([8*number + 5]) + imm32(value) # shorter form just for eax
+            return prefix + b'\x81' + modrm(number, destination) + imm32(value)
+        if is_register(source):
+            return prefix + bytes([8*number + 1]) + modrm(REGISTER_NUMBERS[source], destination)
+        assert is_register(destination), op+' can only have one memory operand'
+        return prefix + bytes([8*number + 3]) + modrm(REGISTER_NUMBERS[destination], source)
+
+    assert False, 'Can not encode '+repr(instruction)
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+# Assembling
+
+def symbol_name(name):
+    # win32 puts an underscore in front of C names, ELF doesn't
+    return name[1:] if name.startswith('_') else name
+
+
+def assemble(instructions):
+    # Returns the machine code and the symbols, a list of (name, offset, global)
+    # in the order the labels appear
+    code = bytearray()
+    symbols = []
+    globals_ = set()
+
+    for instruction in instructions:
+        op = instruction[0]
+        if op == 'section':
+            assert instruction[1] == '.text', 'Only .text can be written'
+        elif op == 'global':
+            globals_.add(instruction[1])
+        elif op == 'label':
+            symbols.append((instruction[1], len(code)))
+        else:
+            code += encode(instruction)
+
+    return bytes(code), [(name, offset, name in globals_) for name, offset in symbols]
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+# ELF64 object files
+
+ELF_HEADER = struct.Struct('<16sHHIQQQIHHHHHH')
+SECTION_HEADER = struct.Struct('<IIQQQQIIQQ')
+SYMBOL = struct.Struct('<IBBHQQ')
+
+ET_REL = 1
+EM_X86_64 = 62
+
+SHT_PROGBITS, SHT_SYMTAB, SHT_STRTAB = 1, 2, 3
+SHF_ALLOC, SHF_EXECINSTR = 0x2, 0x4
+
+STB_LOCAL, STB_GLOBAL = 0, 1
+STT_NOTYPE, STT_FUNC = 0, 2
+
+# The sections, in order (0 is the null section)
+TEXT, SYMTAB, STRTAB, SHSTRTAB, NOTE_GNU_STACK = 1, 2, 3, 4, 5
+SECTION_NAMES = ['', '.text', '.symtab', '.strtab', '.shstrtab', '.note.GNU-stack']
+
+
+class StringTable():
+    # The bytes of an ELF string table, each name is added once
+
+    def __init__(self):
+        self.data = bytearray(b'\0')
+        self.offsets = {'': 0}
+
+    def add(self, name):
+        if not name in self.offsets:
+            self.offsets[name] = len(self.data)
+            self.data += name.encode('utf-8') + b'\0'
+        return self.offsets[name]
+
+
+def object_file(code, symbols):
+    # The bytes of a relocatable object file holding code in .text
+
+    # ELF needs the local symbols before the global ones
+    symbols = sorted(symbols, key=lambda symbol: symbol[2])
+    strtab = StringTable()
+    symtab = bytearray(SYMBOL.size) # the null symbol
+    functions = sorted(offset for name, offset, is_global in symbols if is_global) + [len(code)]
+    for name, offset, is_global in symbols:
+        if is_global:
+            # A function runs to the next function (or the end)
+            size = functions[bisect_right(functions, offset)] - offset if offset < len(code) else 0
+            info = STB_GLOBAL << 4 | STT_FUNC
+        else:
+            size = 0
+            info = STB_LOCAL << 4 | STT_NOTYPE
+        symtab += SYMBOL.pack(strtab.add(symbol_name(name)), info, 0, TEXT, offset, size)
+    first_global = 1 + sum(1 for symbol in symbols if not symbol[2])
+
+    shstrtab = StringTable()
+    names = [shstrtab.add(name) for name in SECTION_NAMES]
+
+    # The contents of each section, one after the other after the header
+    contents = [b'', code, bytes(symtab), bytes(strtab.data), bytes(shstrtab.data), b'']
+    offsets = []
+    offset = ELF_HEADER.size
+    for data in contents:
+        offsets.append(offset)
+        offset += len(data)
+    section_headers_offset = (offset + 7) & ~7 # 8 byte aligned
+
+    headers = [SECTION_HEADER.pack(0, 0, 0, 0, 0, 0, 0, 0, 0, 0),
+               SECTION_HEADER.pack(names[TEXT], SHT_PROGBITS, SHF_ALLOC | SHF_EXECINSTR, 0,
+                                   offsets[TEXT], len(code), 0, 0, 16, 0),
+               SECTION_HEADER.pack(names[SYMTAB], SHT_SYMTAB, 0, 0, offsets[SYMTAB], len(symtab),
+                                   STRTAB, first_global, 8, SYMBOL.size),
+               SECTION_HEADER.pack(names[STRTAB], SHT_STRTAB, 0, 0, offsets[STRTAB],
+                                   len(strtab.data), 0, 0, 1, 0),
+               SECTION_HEADER.pack(names[SHSTRTAB], SHT_STRTAB, 0, 0, offsets[SHSTRTAB],
+                                   len(shstrtab.data), 0, 0, 1, 0),
+               # Empty, marks the stack as not executable
+               SECTION_HEADER.pack(names[NOTE_GNU_STACK], SHT_PROGBITS, 0, 0,
+                                   offsets[NOTE_GNU_STACK], 0, 0, 0, 1, 0)]
+
+    ident = b'\x7fELF' + bytes([2, 1, 1]) # 64 bit, little endian, version 1
+    header = ELF_HEADER.pack(ident, ET_REL, EM_X86_64, 1, 0, 0, section_headers_offset, 0,
+                             ELF_HEADER.size, 0, 0, SECTION_HEADER.size, len(headers), SHSTRTAB)
+
+    body = header + b''.join(contents)
+    return body + bytes(section_headers_offset - len(body)) + b''.join(headers)
+
+
+def write_object(filename, instructions):
+    # Assemble the instructions into an object file
+    code, symbols = assemble(instructions)
+    with open(filename, 'wb') as f:
+        f.write(object_file(code, symbols))
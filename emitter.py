@@ -0,0 +1,133 @@
+################################################# Emitter.py ################################################
+
+# The code generator writes its assembly through an Emitter rather than
+# returning strings. Each instruction is turned into a line of text once and
+# added to a buffer which is written to the output file in large blocks, so
+# the cost of generating code only grows with the amount of code.
+#
+# Optionally the emitter also keeps every instruction as a tuple so later
+# passes can look at the code without parsing the text
+#
+# ('mov', 'eax', '2')   ->  	mov eax, 2
+# ('ret',)              ->  	ret
+# ('label', '_main')    ->  _main:
+#
+# The code uses virtual registers (%v0, %v1, ...) which are given real
+# registers by a regalloc.LinearScanAllocator
+#
+# Passes over the instructions (eg. the register allocator and a
+# peephole.PeepholeOptimizer) can be given to the emitter, the instructions are
+# then held back until the next blank line or flush and passed through each
+# pass's run method in turn before they are written
+#
+# Given a passtimer.PassTimer each pass is timed under its name, and writing
+# the output under 'write'
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+from passtimer import NULL_TIMER
+
+
+def format_instruction(instruction):
+    # The line of assembly for an instruction tuple
+    op = instruction[0]
+    if op == 'label':
+        return instruction[1] + ':\n'
+    if len(instruction) == 1:
+        return '\t' + op + '\n'
+    return '\t' + op + ' ' + ', '.join(instruction[1:]) + '\n'
+
+
+def parse_instructions(text):
+    # The instruction tuples back from lines made by format_instruction
+    instructions = []
+    for line in text.splitlines():
+        if len(line) == 0:
+            continue
+        if not line.startswith('\t'):
+            instructions.append(('label', line[:-1]))
+        elif ' ' in line[1:]:
+            op, operands = line[1:].split(' ', 1)
+            instructions.append((op,) + tuple(operands.split(', ')))
+        else:
+            instructions.append((line[1:],))
+    return instructions
+
+
+class Emitter():
+
+    def __init__(self, output=None, buffer_size=1<<16, keep_instructions=False, passes=(), timer=None):
+        # output is a file (anything with a write method) or None to keep all
+        # the code in memory for getvalue()
+        self.output = output
+        self.buffer_size = buffer_size
+
+        # The text waiting to be written and how long it is
+        self.buffer = []
+        self.buffered = 0
+
+        # The instruction tuples (if they are being kept)
+        self.instructions = [] if keep_instructions else None
+
+        # The instructions waiting for the passes
+        self.passes = list(passes)
+        self.pending = []
+
+        self.timer = timer if timer is not None else NULL_TIMER
+
+    def emit(self, op, *operands):
+        # Add an instruction
+        instruction = (op,) + operands
+        if len(self.passes) != 0:
+            self.pending.append(instruction)
+        else:
+            self.add_instruction(instruction)
+
+    def add_instruction(self, instruction):
+        if self.instructions is not None:
+            self.instructions.append(instruction)
+        self.write(format_instruction(instruction))
+
+    def flush_pending(self):
+        # Run the passes over the held back instructions and add them
+        if len(self.pending) != 0:
+            # Taken off pending first as adding them can fill the buffer and flush
+            instructions = self.pending
+            self.pending = []
+            for instruction_pass in self.passes:
+                with self.timer.phase(instruction_pass.name):
+                    instructions = instruction_pass.run(instructions)
+            for instruction in instructions:
+                self.add_instruction(instruction)
+
+    def label(self, name):
+        # Add a label
+        self.emit('label', name)
+
+    def blank(self):
+        # Add an empty line (only in the text)
+        self.flush_pending()
+        self.write('\n')
+
+    def write(self, text):
+        # Add some text to the buffer, writing it out if the buffer is full
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.output is not None and self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        # Write everything in the buffer to the output
+        self.flush_pending()
+        if self.output is not None and len(self.buffer) != 0:
+            with self.timer.phase('write'):
+                self.output.write(''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+    def getvalue(self):
+        # All the text (only when there is no output file)
+        assert self.output is None, 'The code has already been written to the output'
+        self.flush_pending()
+        return ''.join(self.buffer)
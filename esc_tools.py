@@ -1,78 +1,126 @@
 ################################################# Tools.py ##################################################
 
-# Define some functions and tools that are useful for our python when dealing with defining escaped characters 
+# Define some functions and tools that are useful for our python when dealing with defining escaped characters
 
-
-#-----------------------------------------------------------------------------------------------------------#
+from bisect import bisect_left, bisect_right
 
 
-def replace_with_esc(string, target, new):
-    # init a new string and a boolean for escapement
-    new_string = '' 
-    escape = False
+#-----------------------------------------------------------------------------------------------------------#
 
-    # for each character
-    for char in string:
+# Rather than walking the string again for every find, split or replace, the
+# string is looked at once to build an EscapeIndex which records
+# --> escaped[i] is 1 if the character at i is escaped by the backslash before it
+# --> positions[char] is a sorted list of every place char appears unescaped
+#
+# Example
+# STRING:     a\|b|\\|c
+# escaped:    0 0 1 0 0 0 1 0 0
+# positions:  {'a':[0], '\\':[1,5], '|':[4,7], 'b':[3], 'c':[8]}
+#
+# Notice the | at 7 is not escaped because the backslash before it is itself escaped
+#
+# Every question about a single character can then be answered with a binary
+# search of its positions and the results are built by slicing and joining
+
+class EscapeIndex():
+
+    def __init__(self, string):
+        self.string = string
+        self.escaped = bytearray(len(string))
+        self.positions = {}
+
+        escape = False # escapement boolean
+        for i, char in enumerate(string):
+            if escape: # the character is escaped so it never counts as itself
+                self.escaped[i] = 1
+                escape = False
+            else:
+                if char == '\\': # an unescaped backslash escapes the next character
+                    escape = True
+                self.positions.setdefault(char, []).append(i)
+
+    def is_escaped(self, i):
+        # Is the character at i escaped
+        return self.escaped[i] == 1
+
+    def find(self, target, start=0, end=None):
+        # The first place target appears unescaped in string[start:end] (-1 if none)
+        if end is None:
+            end = len(self.string)
+
+        if len(target) == 1:
+            places = self.positions.get(target, [])
+            k = bisect_left(places, start)
+            if k < len(places) and places[k] < end:
+                return places[k]
+            return -1
+
+        # Longer targets just have to start with an unescaped character
+        i = self.string.find(target, start, end)
+        while i != -1 and self.escaped[i]:
+            i = self.string.find(target, i+1, end)
+        return i
+
+    def rfind(self, target, start=0, end=None):
+        # The last place target appears unescaped in string[start:end] (-1 if none)
+        if end is None:
+            end = len(self.string)
+
+        if len(target) == 1:
+            places = self.positions.get(target, [])
+            k = bisect_right(places, end - 1) - 1
+            if k >= 0 and places[k] >= start:
+                return places[k]
+            return -1
+
+        i = self.string.rfind(target, start, end)
+        while i != -1 and self.escaped[i]:
+            i = self.string.rfind(target, start, i + len(target) - 1)
+        return i
+
+    def find_all(self, target):
+        # Every place target appears unescaped (not overlapping)
+        if len(target) == 1:
+            return self.positions.get(target, [])
+
+        places = []
+        i = self.find(target)
+        while i != -1:
+            places.append(i)
+            i = self.find(target, i + len(target))
+        return places
+
+    def split(self, seperator):
+        # Split the string at every unescaped seperator
+        options = []
+        prev = 0
+        for i in self.find_all(seperator):
+            options.append(self.string[prev:i])
+            prev = i + len(seperator)
+        options.append(self.string[prev:]) # add the last option
+        return options
+
+    def replace(self, target, new):
+        # Replace every unescaped target with new
+        return new.join(self.split(target))
 
-        if escape: # if the character is escaped simply add it to the string regardless and turn escape off
-            new_string += char
-            escape = False
 
-        elif char == '\\': # if character is an unescaped backslash then set escape to true and add to string
-            escape = True
-            new_string += '\\'
+#-----------------------------------------------------------------------------------------------------------#
 
-        else: # otherwise as long as the character isnt the target to remove then add it
-            if char != target:
-                new_string += char
+# The original functions, now answered by an EscapeIndex
 
-    return new_string
 
+def replace_with_esc(string, target, new):
+    return EscapeIndex(string).replace(target, new)
 
 
 def split_with_esc(string, seperator):
-    options = [] # set up the empty list
-    current_string = '' # a buffer string that is added to as we iterate along the string and
-    # peridically saved to options and reset
-    escape = False # escapement boolean
-
-    # for each character in the string
-    for char in string:
-        if escape: # If the character is escaped simply add it to the current string and turn off escape
-            current_string += char
-            escape = False
-
-        elif char == '\\': # if the escapement character turn on escape and add the character to the string
-            # Note escape = false because of the if/elif statement
-            current_string += char
-            escape = True
-
-        elif char == seperator: # If the character is the dividing character then
-            options.append(current_string) # add the previous current_string
-            current_string = '' # and reset current string
-
-        else: # unescaped normal character
-            current_string += char
-
-
-    options.append(current_string) # add the last option which the for loop doesnt catch
-    return options
+    return EscapeIndex(string).split(seperator)
 
 
 def find_with_esc(string, target, start=0, end=None):
-    if end is None:
-        end = len(string)
-    i = string.find(target, start, end) # find the first target
-    while i > 0 and string[i-1] == '\\': # if the character is escaped
-        i = string.find(target, i+1) # try again
+    return EscapeIndex(string).find(target, start, end)
 
-    return i
 
 def rfind_with_esc(string, target, start=0, end=None):
-    if end is None:
-        end = len(string)
-    i = string.rfind(target, start, end) # fin the last target
-    while i > 0 and string[i-1] == '\\': # if the character is escaped
-        i = string.rfind(target, 0, i) # try again
-
-    return i
\ No newline at end of file
+    return EscapeIndex(string).rfind(target, start, end)
@@ -0,0 +1,216 @@
+
+# Three address intermediate representation (IR)
+#
+# The tree is lowered into a flat list of simple instructions before any x86 is
+# made, each one does at most one operation on numbered temporaries
+#
+#   return -~5;   ->   t0 = 5
+#                      t1 = ~t0
+#                      t2 = -t1
+#                      return t2
+#
+# The instructions of a function are stored in four parallel arrays rather than
+# as python objects, instruction i is
+#   ops[i]  the operation (one of the constants below)
+#   dst[i]  the temporary it sets (-1 for none)
+#   a[i]    the first operand (a temporary, or the value for CONST)
+#   b[i]    the second operand (for binary operations, -1 otherwise)
+#
+# The instructions are split into basic blocks (straight line code with one way
+# in and one way out), block k is instructions block_starts[k] to block_starts[k+1]
+#
+# Passes over the IR are functions taking an IRFunction and returning one, run
+# by an optimizer.PassManager. The x86 backend then turns each IRFunction into
+# instructions for an emitter.Emitter
+
+#----------------------------------------------------------------------------------------#
+
+from array import array
+from definitions import wrap_int, UNARY_FOLDS
+
+#----------------------------------------------------------------------------------------#
+
+# The operations
+CONST = 0   # dst = value
+MOV = 1     # dst = a
+NEG = 2     # dst = -a
+NOT = 3     # dst = ~a
+LNOT = 4    # dst = !a
+RET = 5     # return a
+
+OP_NAMES = ['const', 'mov', 'neg', 'not', 'lnot', 'ret']
+
+# The unary operators of the language and their operation
+UNARY_OPERATIONS = {'-': NEG, '~': NOT, '!': LNOT}
+
+# How each operation changes a known value (see definitions.UNARY_FOLDS)
+OPERATION_FOLDS = {operation: UNARY_FOLDS[op] for op, operation in UNARY_OPERATIONS.items()}
+OPERATION_FOLDS[MOV] = lambda value: value
+
+
+class IRFunction:
+
+    def __init__(self, name):
+        self.name = name
+        self.ops = array('B')
+        self.dst = array('l')
+        self.a = array('l')
+        self.b = array('l')
+        self.block_starts = array('l', [0])
+        self.n_temps = 0
+
+    def __len__(self):
+        return len(self.ops)
+
+    def new_temp(self):
+        temp = self.n_temps
+        self.n_temps += 1
+        return temp
+
+    def add(self, op, dst=-1, a=-1, b=-1):
+        # Add an instruction to the current block
+        self.ops.append(op)
+        self.dst.append(dst)
+        self.a.append(a)
+        self.b.append(b)
+
+    def new_block(self):
+        # Start a new basic block, returns its number
+        self.block_starts.append(len(self.ops))
+        return len(self.block_starts) - 1
+
+    def blocks(self):
+        # (start, end) of each basic block
+        ends = list(self.block_starts[1:]) + [len(self.ops)]
+        return list(zip(self.block_starts, ends))
+
+    # Builder methods used when lowering the tree, each returns the temporary set
+
+    def const(self, value):
+        temp = self.new_temp()
+        self.add(CONST, temp, wrap_int(value))
+        return temp
+
+    def unary(self, op, source):
+        temp = self.new_temp()
+        self.add(op, temp, source)
+        return temp
+
+    def ret(self, source):
+        self.add(RET, -1, source)
+
+    def __str__(self):
+        lines = [self.name + ':']
+        for i in range(len(self.ops)):
+            op = self.ops[i]
+            if op == CONST:
+                lines.append('\tt'+str(self.dst[i])+' = '+str(self.a[i]))
+            elif op == RET:
+                lines.append('\treturn t'+str(self.a[i]))
+            else:
+                lines.append('\tt'+str(self.dst[i])+' = '+OP_NAMES[op]+' t'+str(self.a[i]))
+        return '\n'.join(lines)
+
+
+#----------------------------------------------------------------------------------------#
+
+# IR passes
+
+def fold_constants(function):
+    # Work out operations on temporaries with known values at compile time
+    values = {} # temporary -> value for temporaries set by CONST
+    ops, dst, a = function.ops, function.dst, function.a
+
+    for i in range(len(ops)):
+        op = ops[i]
+        if op == CONST:
+            values[dst[i]] = a[i]
+        elif op in OPERATION_FOLDS and a[i] in values:
+            value = OPERATION_FOLDS[op](values[a[i]])
+            ops[i] = CONST
+            a[i] = value
+            values[dst[i]] = value
+
+    return function
+
+
+def remove_dead_code(function):
+    # Remove instructions that set temporaries that are never used
+    # Going backwards, an instruction is needed if it has no result (RET) or
+    # its result is used by a needed instruction
+    used = set()
+    keep = []
+    ops, dst, a, b = function.ops, function.dst, function.a, function.b
+
+    for i in range(len(ops)-1, -1, -1):
+        if dst[i] == -1 or dst[i] in used:
+            keep.append(i)
+            if ops[i] != CONST:
+                used.add(a[i])
+                if b[i] != -1:
+                    used.add(b[i])
+    keep.reverse()
+
+    if len(keep) == len(ops):
+        return function
+
+    new_function = IRFunction(function.name)
+    new_function.n_temps = function.n_temps
+    k = 0
+    new_starts = array('l')
+    for start in function.block_starts:
+        # a block now starts at the first kept instruction at or after its old start
+        while k < len(keep) and keep[k] < start:
+            k += 1
+        new_starts.append(k)
+    new_function.block_starts = new_starts
+    for i in keep:
+        new_function.add(ops[i], dst[i], a[i], b[i])
+
+    return new_function
+
+
+# The passes run by default, in order
+DEFAULT_PASSES = [('ir constant folding', fold_constants),
+                  ('ir dead code', remove_dead_code)]
+
+
+#----------------------------------------------------------------------------------------#
+
+# x86 backend
+# Each temporary becomes a virtual register for the register allocator
+
+def emit_function(function, code):
+    # Add the x86 for an IRFunction to an emitter
+    name = '_'+function.name
+    code.emit('global', name)
+    code.label(name)
+
+    ops, dst, a = function.ops, function.dst, function.a
+    for block, (start, end) in enumerate(function.blocks()):
+        if block != 0:
+            code.label('.'+function.name+'_'+str(block))
+
+        for i in range(start, end):
+            op = ops[i]
+            if op == CONST:
+                code.emit('mov', '%v'+str(dst[i]), str(a[i]))
+
+            elif op == RET:
+                # The value is returned in eax
+                code.emit('mov', 'eax', '%v'+str(a[i]))
+                code.emit('ret')
+
+            else:
+                register = '%v'+str(dst[i])
+                code.emit('mov', register, '%v'+str(a[i]))
+                if op == NEG:
+                    code.emit('neg', register)
+                elif op == NOT:
+                    code.emit('not', register)
+                elif op == LNOT:
+                    # neg sets the carry flag if the value isn't 0, sbb then gives -1 if
+                    # it wasn't 0 and 0 if it was, adding 1 gives 0 or 1
+                    code.emit('neg', register)
+                    code.emit('sbb', register, register)
+                    code.emit('add', register, '1')
@@ -9,8 +9,11 @@
 
 #-----------------------------------------------------------------------------------------------------------#
 
-# Import some tools for lexical parsing escaped characters
-import esc_tools
+# Flat typed arrays for packing graphs once they are built
+from array import array
+
+# For saving the finished lexer tables between runs
+import hashlib, os, struct, sys, zlib
 
 
 # For each piece of programming syntax describe:
@@ -24,6 +27,7 @@ language = [{'regex':'int|void',               'key':'TYPE'},
             {'regex':'return',                 'key':'RETURN'},
             {'regex':';',                      'key':'END STATEMENT'},
             {'regex':'[\\(\\){}\\[\\]]',       'key':'BRACKETS'},
+            {'regex':'!|~|-',                  'key':'UNARY OP'},
             {'regex':'[0-9]+',                 'key':'INTEGER'},
             {'regex':'[0-9]+.[0-9]+',          'key':'FLOAT'},
             {'regex':'[a-zA-Z][a-zA-Z0-9]*',   'key':'IDENTIFIER'}
@@ -31,25 +35,6 @@ language = [{'regex':'int|void',               'key':'TYPE'},
 
 ##    0-9: $   a-z:%   A-Z: @
 
-lowercase_alphabet = list('abcdefghijklmnopqrstuvwxyz')
-uppercase_alphabet = list('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
-digits = list('0123456789')
-
-# Compute the character set
-character_set = set()
-for expression in language:
-    # Expand the short hand notation
-    new_chars = expression['regex'].replace('0-9',''.join(digits)\
-                                    ).replace('a-z',''.join(lowercase_alphabet)\
-                                    ).replace('A-Z',''.join(uppercase_alphabet))
-    # get rid of symbols that are inherintly regex defined
-    for regex_symbol in '[]()+|*':
-        new_chars = esc_tools.replace_with_esc(new_chars, regex_symbol, '')
-
-    # add the new characters
-    for char in new_chars:
-        character_set.add(char)
-
 
 
 #-----------------------------------------------------------------------------------------------------------#
@@ -104,49 +89,134 @@ for expression in language:
 # The graph data structure with be held within a Graph object which will
 # have methods for adding edges and finding neighbours
 
+# Rather than the (s,d) dictionary above, the edges are indexed by their
+# source node so that finding neighbours only looks at the edges leaving a node
+#
+# adjacency[s] = {value: [d, ...]}
+#
+# REPRESENTATION of the example:
+# adjacency = [{},
+#              {e:[2]},
+#              {e:[3,4]},
+#              {'a':[5]},
+#              {'b':[5]},
+#              {'c':[6]},
+#              {}]
+#
+# Once the graph is finished it can be frozen, this packs the index into flat
+# arrays in the same way as a compressed sparse row matrix
+#
+# offsets[s] to offsets[s+1] is the range of edges leaving s
+# edge_labels[k] is the label number of edge k (see labels)
+# edge_targets[k] is the node edge k points to
+
 class Graph():
 
     def __init__(self, size=0):
-        # Define the graph structure as above
-        self.graph = {}
+        # Define the graph structure as above, one dictionary for each node
+        self.adjacency = [{} for i in range(size)]
 
         # The node names should be numbered between 0 and the graph size
         # Defaults to 0
         self.size = size
 
+        # The graph can only be added to before it is frozen
+        self.frozen = False
+
+        # Cache of the epsilon closure of each node (see state_closure)
+        self.closures = {}
+
     def add_node(self):
         # Returns a number to identify a new graph node
+        assert not self.frozen, 'Cannot add nodes to a frozen graph'
 
         new_node = self.size # The new number is the size of the graph
                              # ie when the graph is empty the first node
                              # created will be named 0 then 1,2,3...
         self.size = self.size + 1 # Increase the size by 1
+        self.adjacency.append({}) # and give it an empty set of edges
 
         return new_node
 
     def add_edge(self, source, target, value):
         # The add edge method for our graph structure
-        # (s,d) -> referes to connection from s to d
+        # adjacency[s][value] -> referes to connections from s with the value
+        assert not self.frozen, 'Cannot add edges to a frozen graph'
 
         #Check the source and target values are in range
         assert 0 <= source and source < self.size, 'Source value out of graph range'
         assert 0 <= target and target < self.size, 'Target value out of graph range'
 
-        # Create the edge
-        self.graph[(source, target)] = self.graph.get((source,target),[])+[value]
+        # Any cached closures may now be out of date
+        self.closures = {}
+
+        # Create the edge (if it isn't there already)
+        targets = self.adjacency[source].setdefault(value, [])
+        if not target in targets:
+            targets.append(target)
 
     def get_neighbours(self, node, value):
-        # Return all the edges a node has with a given edge value
+        # Return all the nodes a node has an edge to with a given edge value
+        if not self.frozen:
+            # Just look up the index
+            return list(self.adjacency[node].get(value, []))
+
+        # Otherwise look through the packed edges leaving the node
+        label = self.label_ids.get(value)
+        if label is None: # No edge anywhere in the graph has this value
+            return []
+
         neighbours = [] # Init an array to collect neighbours
+        for k in range(self.offsets[node], self.offsets[node+1]):
+            if self.edge_labels[k] == label:
+                neighbours.append(self.edge_targets[k])
 
-        for i in range(self.size): # For ever other node identifier
-            # Get the edge from the graph
-            edge = self.graph.get((node, i), [])
-            if value in edge: # If the edge exists and has the correct value
-                neighbours.append(i) # Add the node id to array
-        
         return neighbours
 
+    def get_edges(self, node):
+        # Return a list of (value, target) pairs for every edge leaving a node
+        if not self.frozen:
+            return [(value, target) for value, targets in self.adjacency[node].items()
+                                    for target in targets]
+
+        return [(self.labels[self.edge_labels[k]], self.edge_targets[k])
+                for k in range(self.offsets[node], self.offsets[node+1])]
+
+    def freeze(self):
+        # Pack the index into flat arrays once the graph has been built
+        # After this no more nodes or edges can be added
+        if self.frozen:
+            return self
+
+        # Give every edge value a number
+        self.labels = []
+        self.label_ids = {}
+
+        self.offsets = array('l', [0])
+        self.edge_labels = array('l')
+        self.edge_targets = array('l')
+
+        for edges in self.adjacency:
+            for value, targets in edges.items():
+                label = self.label_ids.get(value)
+                if label is None:
+                    label = len(self.labels)
+                    self.labels.append(value)
+                    self.label_ids[value] = label
+
+                for target in targets:
+                    self.edge_labels.append(label)
+                    self.edge_targets.append(target)
+
+            # The edges of the next node start where these finished
+            self.offsets.append(len(self.edge_targets))
+
+        # The dictionaries are no longer needed
+        self.adjacency = None
+        self.frozen = True
+
+        return self
+
 
 
 
@@ -177,479 +247,931 @@ EPSILON = 'EPSILON'
 # what would be complicated regex expressions
 # More compilcated Regex:
 # Square Brackets [abcd] ::= (a|b|c|d)
-# Square Brackets with range [0-9] ::= (0|1|2|3|4|5|6|7|8|9)      (Only comes as a-z, A-Z, 0-9)
+# Square Brackets with range [0-9] ::= (0|1|2|3|4|5|6|7|8|9)      (any range x-y)
 
 # Additionally if the regex operations can be escaped by the backslash to be used as normal strings
 
-# Define a function that will reduce the regex to the four basic operations
 
-def reduce_regex(exp):
-    # We only should find the most deeply nested square brackets first
-    # Search for the first close bracket
-    # We will recursively eliminate the most deeply nested brackets and from left to right
+# The regex is read once from left to right into a small tree (the regex AST)
+# and the NFA is then built from the tree, so both steps take time in proportion
+# to the length of the regex
+#
+# Each node of the tree is a tuple:
+# ('set', chars)        matches any one character in the frozenset chars
+#                       (a normal or escaped character is a set of one)
+# ('cat', [nodes])      each node one after another (an empty list matches nothing)
+# ('alt', [nodes])      any one of the nodes
+# ('star', node)        the node zero or more times
+# ('plus', node)        the node one or more times
+#
+# Example
+# REGEX: (a|b)c*
+# TREE: ('cat', [('alt', [('set', {'a'}), ('set', {'b'})]),
+#                ('star', ('set', {'c'}))])
+
+
+def parse_regex(exp):
+    # Returns the tree for a regex expression
+    node, i = parse_alternation(exp, 0)
+    assert i == len(exp), 'Unmatched ) in regex '+repr(exp)
+    return node
+
+
+def parse_alternation(exp, i):
+    # <alternation> ::= <concatenation> {"|" <concatenation>}*
+    # Each parse function takes the regex and the position to start from and
+    # returns the tree and the position after the part it read
+    branches = []
+    node, i = parse_concatenation(exp, i)
+    branches.append(node)
+
+    while i < len(exp) and exp[i] == '|':
+        node, i = parse_concatenation(exp, i+1)
+        branches.append(node)
+
+    if len(branches) == 1:
+        return branches[0], i
+    return ('alt', branches), i
+
+
+def parse_concatenation(exp, i):
+    # <concatenation> ::= {<atom> {"*" | "+"}*}*
+    items = []
+
+    while i < len(exp) and exp[i] != '|' and exp[i] != ')':
+        atom, i = parse_atom(exp, i)
+
+        # Apply any * and + operators
+        # Note that * overrules + and that nested + or * are the same as 1
+        while i < len(exp) and (exp[i] == '*' or exp[i] == '+'):
+            if exp[i] == '*':
+                if atom[0] == 'star' or atom[0] == 'plus':
+                    atom = atom[1]
+                atom = ('star', atom)
+            elif atom[0] != 'star' and atom[0] != 'plus':
+                atom = ('plus', atom)
+            i += 1
 
-    # We need to be careful to avoid square brackets that have been escaped in the regex strings
+        items.append(atom)
 
-    # Get index of the first closing bracket ']'
-    end_brck_inx = esc_tools.find_with_esc(exp, ']')
+    if len(items) == 1:
+        return items[0], i
+    return ('cat', items), i
 
-    # First the base case where the regex has no brackets
-    if end_brck_inx == -1:
-        return exp
 
-    # Divide the expression into 2 parts around the closing bracket
-    tail_end = exp[(end_brck_inx+1):]
-    front_end = exp[:end_brck_inx]
-    
-    # Now we should search the front end for the last opening bracket to get a pair
-    strt_brck_inx = esc_tools.rfind_with_esc(front_end, '[')
-
-    # Now we can get three pieces
-    inside_exp = front_end[strt_brck_inx+1:]
-    front_end = front_end[:strt_brck_inx]
-    # and tail_end
-
-    #print('a',front_end,'n', inside_exp, 'f',tail_end)
-
-    # Now we should expand the notation in inside expression
-    # We will create a list of all the possible options and then we will concatenate at the end
-    options = []
-
-    # First we should check for our range notation
-    if 'a-z' in inside_exp:
-        # get rid of our shorthand notation and add the lowercase alphabet to our list
-        inside_exp = inside_exp.replace('a-z','')
-        options.extend(lowercase_alphabet)
-
-    if 'A-Z' in inside_exp:
-        # get rid of shorthand and add uppercase alphabet
-        inside_exp = inside_exp.replace('A-Z','')
-        options.extend(uppercase_alphabet)
-
-    if '0-9' in inside_exp:
-        # get rid of shorthand and add digits
-        inside_exp = inside_exp.replace('0-9','')
-        options.extend(digits)
-
-    # now we can add the other characters in our brackets and add them to options
-    # because of escaped characters we dont know how wide each element is and
-    # we will iterate with a while loop
-    # Our implementation assumes no repeats but a repeat will not raise error
-    i = 0
-    while i<len(inside_exp):
-        if inside_exp[i] == '\\':
-            # get the character meant to be escaped
-            escaped_char = inside_exp[i+1]
-            # add it along side it backslash as one item
-            options.append('\\'+escaped_char)
-            # increase the counter by 2
+def parse_atom(exp, i):
+    # <atom> ::= "(" <alternation> ")" | "[" <bracket> "]" | "\" <char> | <char>
+    char = exp[i]
+
+    if char == '(':
+        node, i = parse_alternation(exp, i+1)
+        assert i < len(exp), 'Unmatched ( in regex '+repr(exp)
+        return node, i+1 # skip the )
+
+    if char == '[':
+        return parse_bracket(exp, i+1)
+
+    if char == '\\':
+        assert i+1 < len(exp), 'Regex ends with a backslash '+repr(exp)
+        return ('set', frozenset(exp[i+1])), i+2
+
+    assert char != '*' and char != '+', 'Nothing to repeat in regex '+repr(exp)
+    return ('set', frozenset(char)), i+1
+
+
+def parse_bracket(exp, i):
+    # Reads the contents of square brackets starting just after the [
+    # and returns a set node and the position after the ]
+    chars = set()
+
+    while i < len(exp) and exp[i] != ']':
+        if exp[i] == '\\':
+            # An escaped character
+            assert i+1 < len(exp), 'Regex ends with a backslash '+repr(exp)
+            chars.add(exp[i+1])
             i += 2
+        elif i+2 < len(exp) and exp[i+1] == '-' and exp[i+2] != ']':
+            # A range like a-z
+            assert exp[i] <= exp[i+2], 'Backwards range in regex '+repr(exp)
+            for code in range(ord(exp[i]), ord(exp[i+2])+1):
+                chars.add(chr(code))
+            i += 3
         else:
-            # not an escaped character simply append and increment the counter
-            options.append(inside_exp[i])
+            chars.add(exp[i])
             i += 1
 
-    # Our new inside_exp is all the options seperated by bars and surrounded by brackets
-    new_inside_exp = '('+'|'.join(options)+')'
-
-    # Reassembling our expression we get
-    exp = front_end+new_inside_exp+tail_end
+    assert i < len(exp), 'Unmatched [ in regex '+repr(exp)
+    return ('set', frozenset(chars)), i+1 # skip the ]
 
-    #print('Yes its now: ',exp)
-    # Now we recursively call this function on it until all brackets are gone
-    return reduce_regex(exp)
 
-
-# Now we need to parse our reduced regex into a NFA graph
+# Now we need to parse our regex tree into a NFA graph
 
 # Define a function that takes parameters:
-# Exp - a regex expression
+# Node - a regex tree
 # Graph - a NFA graph
 # Input node name
 # Output node name
 
+def tree_to_NFA(node, graph, input_node, end_node):
+    kind = node[0]
+
+    if kind == 'set':
+        # One edge from the input to the output for every character in the set
+        for char in sorted(node[1]):
+            graph.add_edge(input_node, end_node, char)
+
+    elif kind == 'cat':
+        # Each item gets a node with serves as its output and the next item's input
+        # apart from the last node which uses the original output
+        items = node[1]
+        if len(items) == 0:
+            # Matches nothing so just join the input to the output
+            graph.add_edge(input_node, end_node, EPSILON)
+
+        prev_output = input_node # first item gets the input node
+        for i, item in enumerate(items):
+            if i == len(items)-1: # last node
+                output = end_node # so output is the actual output node
+            else:
+                output = graph.add_node() # for ever other node just create a new node
+
+            tree_to_NFA(item, graph, prev_output, output)
+            prev_output = output
+
+    elif kind == 'alt':
+        # From the input node we create as many branches as there is options
+        for branch in node[1]:
+            tree_to_NFA(branch, graph, input_node, end_node)
+
+    elif kind == 'star':
+        # Implemented by a loop back to a node
+        # First of all create the node that the loop exits and returns to
+        loop_node = graph.add_node()
+        # Join to input and output with EPSILON
+        graph.add_edge(input_node, loop_node, EPSILON)
+        graph.add_edge(loop_node, end_node, EPSILON)
+        # The loop body goes from the loop node back to itself
+        tree_to_NFA(node[1], graph, loop_node, loop_node)
+
+    elif kind == 'plus':
+        # Implemented by two loop nodes that are joined with a link going backwards
+        # and the loop body between them
+        first_loop_node = graph.add_node()
+        scnd_loop_node = graph.add_node()
+        # connect the first node to the input
+        graph.add_edge(input_node, first_loop_node, EPSILON)
+        # add the backwards link
+        graph.add_edge(scnd_loop_node, first_loop_node, EPSILON)
+        # connect the second node to the output
+        graph.add_edge(scnd_loop_node, end_node, EPSILON)
+
+        tree_to_NFA(node[1], graph, first_loop_node, scnd_loop_node)
+
+    else:
+        assert False, 'Unknown regex tree node '+repr(kind)
+
 
 def regex_to_NFA(exp, graph, input_node, end_node):
-    # First we need to clean our regex to get rid of complicated syntax
+    # Adds the NFA for a regex expression to the graph between the input and output nodes
+    tree_to_NFA(parse_regex(exp), graph, input_node, end_node)
 
-    #print('Cleaning complex syntax:')
-    exp = reduce_regex(exp)
-    #print('\tNew_exp:',exp)
-    
-    # Now we should ommit the brackets in our answer for recursive parsing
-    # We should iterate over the exp and split the string at the highest level
-    # of bracket
-    # 
-    # eg. convert   a|b|c(a|b*)(aa(d|dd))+
-    # to  a|b|c()()+
-    # and collect the nested bracket contents in an array
-    brckt_conts = []
 
-    i = esc_tools.find_with_esc(exp, '(') # find the first starting bracket
+# define a little function that creates an NFA given a regex expression
+# used for testing purposes
 
-    nesting_level = 0 # how many brackets have we already seen
+def getNFA(regex):
+    x = Graph()
+    inputn = x.add_node()
+    outputn = x.add_node()
+    regex_to_NFA(regex, x, inputn, outputn)
+    return x
 
-    while i<len(exp) and i != -1:
-        # now create an empty string for the bracket contents
-        brckt_contents = ''
+#-----------------------------------------------------------------------------------------------------------#
 
-        starting_i = i # save the starting position of the brackets for use later
+# Now we should turn our NFA into a DFA
+# Then reduce the DFA into a minimal DFA
 
-        # now iterate over the expression until we find a closing brackt that matches the level
-        i += 1 # start at the next character
+# Define a function epsilon_closure that returns the epsilon closure of list of points in a graph
 
-        escape = False # set escapement boolean to false
+# The closure of a single point never changes once the graph is built so they
+# are worked out once and cached on the graph, the closure of a set of points
+# is then just the union of the closures of each point
 
-        while i < len(exp): 
-            # while we havent found the matching closing bracket
-            if exp[i] == ')' and nesting_level == 0 and not escape:
-                break
+def state_closure(graph, point):
+    # Return the epsilon closure of a single point as a frozenset
+    closure = graph.closures.get(point)
 
-            if exp[i] == '(' and not escape: # If there is a new opening bracket that isnt escaped
-                nesting_level += 1 # then increase the nesting_level
+    if closure is None:
+        # Not worked out yet so follow the epsilon edges with a worklist
+        # visiting each point only once (no recursion so deep NFAs are fine)
+        closure = {point}
+        worklist = [point]
 
-            elif exp[i] == ')' and not escape: # If there is a closing bracket that isnt escaped
-                nesting_level -= 1 # then decrease the nesting_level
+        while len(worklist) != 0:
+            current = worklist.pop()
+            for conn in graph.get_neighbours(current, EPSILON):
+                if not conn in closure: # Only points we haven't seen yet
+                    closure.add(conn)
+                    worklist.append(conn)
 
-            # Handle escapement
-            if exp[i] == '\\' and not escape: # If there is an unescaped escape char
-                escape = True # Set escape to be true
-            else:
-                escape = False # Either turn escape off or do nothing
+        closure = frozenset(closure)
+        graph.closures[point] = closure
+
+    return closure
 
-            # We havent found the closing bracket so 
-            # add the contents to the contents string
-            brckt_contents += exp[i]
-            
-            i += 1 # increment i
+def epsilon_closure(graph, points):
+    # Create a new set to be filled with connected points + original points
+    new_points = set()
 
-        brckt_conts.append(brckt_contents) # add the contents of the bracket to the list
+    for point in points:
+        # If the point is already in the set then so is its whole closure
+        if not point in new_points:
+            new_points |= state_closure(graph, point)
+
+    return new_points
+
+def move(points, NFA, value):
+    # Given a set of possible points compute the next set of possible points
+    # for a traversal value
+    new_points = set()
+    for point in points:
+        for conn in NFA.get_neighbours(point, value):
+            new_points.add(conn)
+    return new_points
 
-        # delete the contents of the bracket from the exp string (Notice this changes the index i)
-        exp = exp[:starting_i+1] + exp[i:]
-        # the position i refered to in the old exp can now be indexed by starting_i+1
 
-        i = esc_tools.find_with_esc(exp, '(',starting_i+1) # now we find the next opening bracket to repeat the process
-        
+# Most characters behave exactly the same way in every expression (eg all the
+# letters except those in keywords) so there is no point working out the DFA
+# edges for each one separately. Each regex uses some sets of characters (a
+# square bracket or a single character), two characters are equivalent if they
+# are in exactly the same sets in every regex. The characters are split into
+# these classes and the DFA is built with one edge per class rather than one
+# per character
 
-    #print('Handling brackets')
-    #print('\tNew exp:',exp,'\n\tBracket contents:',brckt_conts)
+def regex_char_sets(exp):
+    # Returns a list of the sets of characters (as strings) used in a regex
+    char_sets = []
 
-    # Now we start by dividing the expression into the lowest precedence operator |
-    # We treat the empty bracket pairs () as single elements and retrieve their contents
-    # from the list.
+    # Walk the regex tree collecting the set nodes
+    stack = [parse_regex(exp)]
+    while len(stack) != 0:
+        node = stack.pop()
+        if node[0] == 'set':
+            char_sets.append(''.join(sorted(node[1])))
+        elif node[0] == 'cat' or node[0] == 'alt':
+            stack.extend(node[1])
+        else: # star or plus
+            stack.append(node[1])
 
-    # From the input node we create as many branches as there is options
+    return char_sets
 
-    #print('Parsing Branches')
 
-    # Create an array called options for each part split by | with escapement handling
-    options = esc_tools.split_with_esc(exp, '|')
-    #print('Options: ',options, exp)
+def alphabet_classes(language):
+    # Returns a list of strings, each holding the characters of one class
+    # (ordered by their smallest character)
 
-    # now parse each branch individually
-    for branch in options:
-        #print('\tCreating a branch for ',branch)
-        
-        # We can parse from the highest precence in each  (*, +, concat)
+    # Number every set of characters in the language
+    char_sets = []
+    for expression in language:
+        char_sets.extend(regex_char_sets(expression['regex']))
 
-        # first we should implement the recursive base case where the regex is 1 character
-        # and the case where the regex is just brackets
+    # For every character collect the sets it is in
+    signatures = {}
+    for set_number, chars in enumerate(char_sets):
+        for char in chars:
+            signatures.setdefault(char, []).append(set_number)
 
+    # Group characters that are in the same sets
+    classes = {}
+    for char in sorted(signatures):
+        classes.setdefault(tuple(signatures[char]), []).append(char)
 
+    return [''.join(chars) for chars in classes.values()]
 
-        if len(branch) == 1:
-            # The regex is just one character
-            # First we create a node for the option
-            node = graph.add_node()
-            # Then we add an edge to the node from the input with the value EPSILON
-            graph.add_edge(input_node, node, EPSILON)
-            # Then connect the node to the output
-            graph.add_edge(node, end_node, branch)
 
+# Sets of NFA points are held as integer bitmasks during subset construction
+# bit p of the mask is set when point p is in the set, eg {0, 2, 3} -> 0b1101
+# This makes the union of two sets a single | and the sets can be used
+# directly as dictionary keys
 
+def points_to_mask(points):
+    # Turn a set of points into a bitmask
+    mask = 0
+    for point in points:
+        mask |= 1 << point
+    return mask
+
+def mask_to_points(mask):
+    # Turn a bitmask back into a list of points
+    points = []
+    while mask:
+        low_bit = mask & -mask # the lowest set bit
+        points.append(low_bit.bit_length() - 1)
+        mask ^= low_bit
+    return points
+
+
+def step_masks(NFA, classes):
+    # For every NFA point work out, for each character class, the epsilon closure
+    # of the points it moves to as a mask. Returns a list with, for each point,
+    # a list of (class number, mask) for the classes that go somewhere
+    closures = [points_to_mask(state_closure(NFA, point)) for point in range(NFA.size)]
+
+    steps = []
+    for point in range(NFA.size):
+        point_steps = []
+        for class_number, characters in enumerate(classes):
+            # any character of the class will do so use the first
+            mask = 0
+            for conn in NFA.get_neighbours(point, characters[0]):
+                mask |= closures[conn]
+            if mask:
+                point_steps.append((class_number, mask))
+        steps.append(point_steps)
+
+    return steps
+
+
+def NFA_to_DFA(DFA, NFA, NFA_input_node, classes):
+    # The DFA edges are labelled with the number of the character class in
+    # classes (from alphabet_classes)
+    
+    # The algorithm to create a DFA from an NFA involves traversing every path on the NFA at once
+    # taking the epsilon-closure at every stage.
+    # Example
+    # Starting with {0} the input node, take the epsilon-closure({0})
+    # Then for each character in the language calculate the set of points that can be reached
+    # Then take the epsilon closure of that and so on
 
+    # For each set of possible NFA positions create a DFA node referenced by a dictionary
+    # Dict:    mask of NFA points  ---> DFA node
+    #                 int          --->   int
 
-        elif branch == '()':
-            # The regex is our empty bracket notation so we pop the contents from brckt_conts list
-            # first in first out so take from the start
-            contents = brckt_conts.pop(0)
-            # recursively call the regex_to_NFA function
-            regex_to_NFA(contents, graph, input_node, end_node)
+    DFA_nodes = {}
 
+    # Since the closure of each point is known the move and epsilon closure from a
+    # set of points is just the | of the step masks of each point
+    steps = step_masks(NFA, classes)
 
+    # We start with the input node to the NFA and its epsilon-closure
+    DFA_in = points_to_mask(state_closure(NFA, NFA_input_node))
+    # create a DFA node for the current NFA possibility
+    DFA_nodes[DFA_in] = DFA.add_node()
 
+    # Create a stack of NFA possiblilities to compute further from
+    # For every mask in here, DFA_nodes[mask] will be its node
+    compute_stack = [DFA_in]
 
-        elif len(branch) == 2 and branch[0] == '\\':
-            # The regex is a single escaped character
-            # First we create a node for the option
-            node = graph.add_node()
-            # Then we add an edge to the node from the input with the value EPSILON
-            graph.add_edge(input_node, node, EPSILON)
-            # Then connect the node to the output
-            graph.add_edge(node, end_node, branch)
+    while len(compute_stack) != 0: # While the computation stack is not empty
 
+        current_DFA_pos = compute_stack.pop()
+        current_DFA_node = DFA_nodes[current_DFA_pos]
 
+        # For each of the character classes calculate a possible NFA state
+        new_positions = [0] * len(classes)
+        for point in mask_to_points(current_DFA_pos):
+            for class_number, mask in steps[point]:
+                new_positions[class_number] |= mask
 
+        for class_number, new_pos in enumerate(new_positions):
+            if new_pos == 0: # The set is empty
+                continue
 
-        else:
-            # The regex statement either has more than one character or uses +,* operators
-
-            # Handle the case where the statement is a single (escaped?) character or brackets
-            # that has + and * operations applied
-            # Note that * overrules + and that nested + or * are the same as 1
-
-            root = esc_tools.replace_with_esc(esc_tools.replace_with_esc(branch, '*',''),'+','')
-            if len(root) == 1 or root == '()' or root[0]=='\\':
-                extensions = esc_tools.replace_with_esc(branch, root, '')
-                #print('\tNo concatenation!', extensions)
-                # Two cases
-                # Contains * or contains both
-                # Contains +
-                # Cant contain neither because the previous else clauses should handle that
-
-                if '*' in extensions:
-                    # Contains * or contains both
-                    #print('\tMultiple')
-                    # Implemented by a loop back to a node
-                    # First of all create the node that the loop exits and returns to
-                    loop_node = graph.add_node()
-                    # Then add this node as an option for the branch
-                    # Join to input and output with EPSILON
-                    graph.add_edge(input_node, loop_node, EPSILON)
-                    graph.add_edge(loop_node, end_node, EPSILON)
-
-                    # Now recursively call this function on the root part passing both the input and output 
-                    # as our loop node to create a loop
-
-                    # first check whether we need to get contents from brackets
-                    if root == '()':
-                        root = brckt_conts.pop(0) # remove from start of bracket list
-                    
-                    regex_to_NFA(root, graph, loop_node, loop_node)
+            points_to = DFA_nodes.get(new_pos)
+            if points_to is None:
+                # This possibility has never been seen before
+                # Create a new DFA node to refer to it
+                points_to = DFA.add_node()
+                DFA_nodes[new_pos] = points_to
 
+                # Now add it to the computation stack so that its connections can be computed
+                compute_stack.append(new_pos)
+
+            # Now connect it to the node it was connected to
+            DFA.add_edge(current_DFA_node, points_to, class_number)
+
+
+    return DFA_nodes
+
+
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+# Now reduce the DFA into a minimal DFA
+
+# Each DFA node accepts the token of the first expression in the language whose
+# NFA output node is one of its NFA points (so earlier expressions have priority)
+# or accepts nothing
+
+def DFA_accepts(DFA_nodes, output_nodes):
+    # Given the DFA_nodes dictionary from NFA_to_DFA and the NFA output node for
+    # each expression in the language return a list of which expression each DFA
+    # node accepts (-1 for none)
+    accepts = [-1] * len(DFA_nodes)
+
+    for points, node in DFA_nodes.items():
+        for rule, output_node in enumerate(output_nodes):
+            if points >> output_node & 1: # the output node is in the mask
+                accepts[node] = rule
+                break # the first expression found has priority
+
+    return accepts
+
+
+# The minimal DFA is found by Hopcroft's partition refinement
+#
+# Start by splitting the nodes into groups that accept the same token
+# (and one group for nodes that accept nothing)
+# Then repeatedly take a group A (a splitter) and a character c, and find the
+# nodes X that go to A on c. Any group that has some nodes in X and some not
+# can't be a single node in the minimal DFA so is split in two.
+# When nothing splits any more each group becomes one node of the minimal DFA
+#
+# The result is stored as a dense table rather than a Graph
+#
+# transitions[state * n_columns + column] -> next state (-1 means no token can be made)
+# accept[state] -> index of the expression in the language accepted (-1 for none)
+# columns[ord(char)] -> the column (character class) of the character (-1 for not in the language)
+
+def class_columns(classes):
+    # Returns an array giving every character code up to 255 its column
+    # (the number of its class) or -1 if it isn't in any class
+    columns = array('i', [-1] * 256)
+    for column, chars in enumerate(classes):
+        for char in chars:
+            columns[ord(char)] = column
+    return columns
+
+def class_translation(classes):
+    # The same as class_columns but as bytes with 255 for no column
+    assert len(classes) < 255, 'Too many columns for a byte translation'
+    return bytes(column if column != -1 else 255 for column in class_columns(classes))
+
+
+class DFATable():
+
+    def __init__(self, n_states, symbols, keys):
+        # The characters that share each column in the table (a class from alphabet_classes)
+        self.symbols = list(symbols)
+        self.n_columns = len(self.symbols)
+        self.n_states = n_states
+
+        # The key passed on to the parser for each expression in the language
+        self.keys = list(keys)
+
+        # Every character code up to 255 gets a column number
+        self.columns = class_columns(self.symbols)
+
+        # Initially every transition goes nowhere and no state accepts
+        self.transitions = array('i', [-1] * (n_states * self.n_columns))
+        self.accept = array('i', [-1] * n_states)
+
+        # The minimal DFA always starts at state 0
+        self.start = 0
+
+    def next_state(self, state, char):
+        # Follow the transition from a state on a character (-1 if there isn't one)
+        code = ord(char)
+        if code > 255 or self.columns[code] == -1:
+            return -1
+        return self.transitions[state * self.n_columns + self.columns[code]]
+
+    def column_translation(self):
+        # A 256 byte translation table (for bytes.translate) that turns each
+        # character code into its column, 255 is used for no column
+        return class_translation(self.symbols)
+
+    def get_key(self, state):
+        # The key of the token accepted in a state (or None)
+        rule = self.accept[state]
+        if rule == -1:
+            return None
+        return self.keys[rule]
+
+
+def minimize_DFA(DFA, DFA_start, accepts, keys, classes):
+    # Takes the DFA graph from NFA_to_DFA, its starting node, the accepts list from
+    # DFA_accepts, the keys of the language and the character classes the DFA
+    # was built with and returns a minimal DFATable
+
+    symbols = classes
+    n = DFA.size
+    dead = n # An extra node that every missing edge goes to, so every node has
+             # an edge for every character
+
+    # delta[node][c] -> node reached on the c'th character class
+    delta = [[dead] * len(symbols) for node in range(n + 1)]
+    for node in range(n):
+        for c, target in DFA.get_edges(node):
+            delta[node][c] = target
+
+    # The reverse edges, inverse[c][node] -> list of nodes that reach node on c
+    inverse = [[[] for node in range(n + 1)] for c in range(len(symbols))]
+    for node in range(n + 1):
+        for c in range(len(symbols)):
+            inverse[c][delta[node][c]].append(node)
+
+    # Create the starting groups, one for each token accepted
+    groups_by_accept = {}
+    for node in range(n + 1):
+        accepted = accepts[node] if node < n else -1
+        groups_by_accept.setdefault(accepted, set()).add(node)
+
+    groups = list(groups_by_accept.values())
+    group_of = [0] * (n + 1)
+    for g, group in enumerate(groups):
+        for node in group:
+            group_of[node] = g
+
+    # Every starting group needs to be used as a splitter
+    waiting = list(range(len(groups)))
+    is_waiting = [True] * len(groups)
+
+    while len(waiting) != 0:
+        splitter = waiting.pop()
+        is_waiting[splitter] = False
+        splitter_nodes = list(groups[splitter])
+
+        for c in range(len(symbols)):
+            # Find the nodes that reach the splitter on this character
+            # and collect them by the group they are in
+            touched = {}
+            for target in splitter_nodes:
+                for node in inverse[c][target]:
+                    touched.setdefault(group_of[node], set()).add(node)
+
+            for g, inside in touched.items():
+                if len(inside) == len(groups[g]):
+                    continue # the whole group goes to the splitter so no split
+
+                # Split the group, the nodes outside X keep the group number
+                groups[g] = groups[g] - inside
+                new_g = len(groups)
+                groups.append(inside)
+                is_waiting.append(False)
+                for node in inside:
+                    group_of[node] = new_g
+
+                # If the old group was waiting then both halves need to be used,
+                # otherwise using the smaller half is enough
+                if is_waiting[g] or len(inside) <= len(groups[g]):
+                    waiting.append(new_g)
+                    is_waiting[new_g] = True
                 else:
-                    # Contains +
-                    #print('\tAt least one')
-                    # Implemented by two loop nodes that are joined with a link going backwards
-                    # and the loop body defined by root
-                    first_loop_node = graph.add_node()
-                    scnd_loop_node = graph.add_node()
-                    # connect the first node to the input
-                    graph.add_edge(input_node, first_loop_node, EPSILON)
-                    # add the backwards link
-                    graph.add_edge(scnd_loop_node, first_loop_node, EPSILON)
-                    # connect the second node to the output
-                    graph.add_edge(scnd_loop_node, end_node, EPSILON)
+                    waiting.append(g)
+                    is_waiting[g] = True
+
+    # Now number the groups as states of the minimal DFA in the order they are
+    # found from the start, the group with the dead node is left out
+    dead_group = group_of[dead]
+    state_of = {group_of[DFA_start]: 0}
+    order = [group_of[DFA_start]]
+    i = 0
+    while i < len(order):
+        node = next(iter(groups[order[i]])) # any node in the group will do
+        for c in range(len(symbols)):
+            g = group_of[delta[node][c]]
+            if g != dead_group and not g in state_of:
+                state_of[g] = len(order)
+                order.append(g)
+        i += 1
+
+    # Fill in the table
+    table = DFATable(len(order), symbols, keys)
+    for state, g in enumerate(order):
+        node = next(iter(groups[g]))
+        table.accept[state] = accepts[node]
+        for c in range(len(symbols)):
+            target_group = group_of[delta[node][c]]
+            if target_group != dead_group:
+                table.transitions[state * table.n_columns + c] = state_of[target_group]
+
+    return table
 
-                    # The loop body will again be a recursive call to this function passing the input as
-                    # out first loop node and the output as our scnd loop node
 
-                    # first check whether we need to get contents from brackets
-                    if root == '()':
-                        root = brckt_conts.pop(0) # remove from start of bracket list
-                    
-                    regex_to_NFA(root, graph, first_loop_node, scnd_loop_node)
+#-----------------------------------------------------------------------------------------------------------#
 
+# Put all the steps together to go from the language to the lexer tables
 
+def build_NFA(language):
+    # Create one NFA for the whole language with a single input node and an
+    # output node for each expression. Returns the NFA, input and output nodes
+    NFA = Graph()
+    input_node = NFA.add_node()
+    output_nodes = []
 
+    for expression in language:
+        output_node = NFA.add_node()
+        regex_to_NFA(expression['regex'], NFA, input_node, output_node)
+        output_nodes.append(output_node)
 
-            else:
-                # In this case the branch is a string of concatenated statements with each
-                # item possibly having *,+ operators on them
-                # All we need to do is seperate each item and recursively call this function
-                # on each
-
-                # First create a list of elements in concatentation bound by +,*
-
-                parts = []
-                i = 0 # We iterate through with a while since we do not know how many elements
-                current_elm = ''
-                escaped = False
-                ready = False
-
-                # fails on \\+*
-
-                for char in branch:
-
-                    if ready and not char in '+*': # If the substring is a complete item and the
-                                                   # current char is not a operator
-                        # The current index is the start of a new item
-                        # Add the previous item
-                        parts.append(current_elm)
-                        # Restart the current_elm buffer
-                        current_elm = ''
-                        ready = False
-
-                    if escaped: # If the character is escaped add it to the buffer string
-                        current_elm += char
-                        escaped = False
-                        ready = True
-
-                    elif char == '\\': # If the character is an unescaped backslash then
-                        current_elm += char # add the backslash to the buffer string
-                        escaped = True # set escaped to True
-
-                    else:
-                        if char != '(':
-                            ready = True
-                        current_elm += char
-
-                parts.append(current_elm) # Append the last item (not done by loop)
-
-                #print(parts)
-
-                # Now we have each part of the concatenation we just iterate through the graph
-                # in a chain like structure
-                # Each item gets a node with serves as its output and the next item's input
-                # apart from the last node which uses the original output
-
-                prev_output = input_node # first item gets the input node
-
-                for i,item in enumerate(parts):
-                    #print('\t\t Recursively call on ',item)
-
-                    # get the ouput node
-                    if i == len(parts)-1: # last node
-                        output = end_node # so output is the actual output node
-                    else:
-                        output = graph.add_node() # for ever other node just create a new node
-
-                    # recursively call the function with the item
-                    if '()' in item:
-                        # if item is brackets then get the contents from brck_conts
-                        # The regex is our empty bracket notation so we pop the contents from brckt_conts list
-                        # first in first out so take from the start
-                        item = item.replace('()', '('+brckt_conts.pop(0)+')')
-                    
-                    
-                    regex_to_NFA(item, graph, prev_output, output)
-
-                    # update prev_output
-                    prev_output = output
-                        
+    # The NFA is finished so pack it for fast lookups
+    NFA.freeze()
+
+    return NFA, input_node, output_nodes
+
+
+def build_tables(language):
+    # Returns the minimal DFATable for the language
+    NFA, input_node, output_nodes = build_NFA(language)
+    classes = alphabet_classes(language)
+
+    DFA = Graph()
+    DFA_nodes = NFA_to_DFA(DFA, NFA, input_node, classes)
+    accepts = DFA_accepts(DFA_nodes, output_nodes)
+
+    # The DFA was empty so its first node (0) is the input
+    return minimize_DFA(DFA, 0, accepts, [expression['key'] for expression in language], classes)
 
-# define a little function that creates an NFA given a regex expression
-# used for testing purposes
 
-def getNFA(regex):
-    x = Graph()
-    inputn = x.add_node()
-    outputn = x.add_node()
-    regex_to_NFA(regex, x, inputn, outputn)
-    return x
 
 #-----------------------------------------------------------------------------------------------------------#
 
-# Now we should turn our NFA into a DFA
-# Then reduce the DFA into a minimal DFA
+# Building every DFA state up front can be slow for a big language, and most
+# inputs only ever reach a few of the states. A lazy DFA instead starts with
+# just the NFA and works out each DFA state (and each transition) the first
+# time the input reaches it, using the same bitmask steps as NFA_to_DFA.
+#
+# The states are kept in a cache of at most max_states states. When it is full
+# the whole cache is emptied and filled again from where the scanner is.
+# If the cache keeps filling up after only a little input (it is thrashing)
+# the DFA gives up caching and simulates the NFA directly instead.
+#
+# The tables are stored the same way the Scanner stores a DFATable, a state is
+# the offset of its row in transitions, with UNKNOWN for transitions that
+# haven't been worked out yet
+
+UNKNOWN = -2
+
+class LazyDFA():
+
+    def __init__(self, language, max_states=1000, min_bytes_per_state=10):
+        self.NFA, input_node, self.output_nodes = build_NFA(language)
+        self.keys = [expression['key'] for expression in language]
+        self.classes = alphabet_classes(language)
+        self.n_columns = len(self.classes)
+
+        self.columns = class_columns(self.classes)
+
+        # For each NFA point a dictionary of class number -> mask it steps to and
+        # the mask of its epsilon closure, both worked out the first time the
+        # point is stepped from (None until then)
+        self.steps = [None] * self.NFA.size
+        self.closures = [None] * self.NFA.size
+        self.start_mask = self.closure_mask(input_node)
+
+        # The state cache
+        self.max_states = max_states
+        self.transitions = []
+        self.accept = []     # indexed by row offset like transitions
+        self.masks = []      # the NFA points of each state
+        self.state_of = {}   # mask -> row offset
+
+        # Thrash detection, the scanner adds to bytes_scanned as it goes
+        self.min_bytes_per_state = min_bytes_per_state
+        self.bytes_scanned = 0
+        self.bytes_at_flush = 0
+        self.thrashing = 0
+        self.flushes = 0
+        self.fallback = False # True once the NFA is simulated instead
+
+    def column_translation(self):
+        # A 256 byte translation table for bytes.translate (see DFATable)
+        return class_translation(self.classes)
+
+    def rule_of(self, mask):
+        # The expression accepted by a set of NFA points (-1 for none)
+        for rule, output_node in enumerate(self.output_nodes):
+            if mask >> output_node & 1:
+                return rule
+        return -1
+
+    def closure_mask(self, point):
+        # The epsilon closure of an NFA point as a mask
+        mask = self.closures[point]
+        if mask is None:
+            mask = points_to_mask(state_closure(self.NFA, point))
+            self.closures[point] = mask
+        return mask
+
+    def point_steps(self, point):
+        # Works out the class number -> mask dictionary of an NFA point from one
+        # pass over its edges (every character of a class goes to the same places)
+        steps = {}
+        for value, target in self.NFA.get_edges(point):
+            if value == EPSILON:
+                continue
+            column = self.columns[ord(value)]
+            steps[column] = steps.get(column, 0) | self.closure_mask(target)
+        self.steps[point] = steps
+        return steps
+
+    def step(self, mask, column):
+        # The mask of NFA points reached from a mask on a class
+        new_mask = 0
+        for point in mask_to_points(mask):
+            steps = self.steps[point]
+            if steps is None:
+                steps = self.point_steps(point)
+            new_mask |= steps.get(column, 0)
+        return new_mask
+
+    def get_state(self, mask):
+        # Returns the row offset of the state for a mask, adding it if needed
+        row = self.state_of.get(mask)
+        if row is None:
+            row = len(self.transitions)
+            self.transitions.extend([UNKNOWN] * self.n_columns)
+            self.accept.extend([-1] * self.n_columns)
+            self.accept[row] = self.rule_of(mask)
+            self.masks.append(mask)
+            self.state_of[mask] = row
+        return row
+
+    def start_state(self):
+        return self.get_state(self.start_mask)
+
+    def add_transition(self, row, column):
+        # Works out an UNKNOWN transition and returns the row it goes to (-1 for none)
+        mask = self.masks[row // self.n_columns]
+        new_mask = self.step(mask, column)
+        if new_mask == 0:
+            self.transitions[row + column] = -1
+            return -1
+
+        if not new_mask in self.state_of and len(self.masks) >= self.max_states:
+            # The cache is full, empty it and add back the state we are in
+            self.flush()
+            row = self.get_state(mask)
+
+        target = self.get_state(new_mask)
+        self.transitions[row + column] = target
+        return target
+
+    def flush(self):
+        # Empty the state cache, the lists are emptied in place so anyone holding
+        # them (the scanner) sees the change
+        del self.transitions[:]
+        del self.accept[:]
+        self.masks = []
+        self.state_of = {}
+        self.flushes += 1
+
+        # Check how much input was scanned since the last flush
+        if self.bytes_scanned - self.bytes_at_flush < self.min_bytes_per_state * self.max_states:
+            self.thrashing += 1
+        else:
+            self.thrashing = 0
+        self.bytes_at_flush = self.bytes_scanned
+
+        if self.thrashing >= 3:
+            self.fallback = True
+
+    def simulate(self, columns, i, n):
+        # Run the NFA directly from position i of the columns without caching
+        # Returns the last rule accepted, where it ended and where the NFA stopped
+        mask = self.start_mask
+        last_rule = -1
+        last_end = i
+        j = i
+        while j < n:
+            column = columns[j]
+            if column == 255:
+                break
+            mask = self.step(mask, column)
+            if mask == 0:
+                break
+            j += 1
+            rule = self.rule_of(mask)
+            if rule != -1:
+                last_rule = rule
+                last_end = j
+        return last_rule, last_end, j
 
-# Define a function epsilon_closure that returns the epsilon closure of list of points in a graph
-def epsilon_closure(graph, points):
-    
-    # for each point in set_points get all the epsilon connections and add them to new_points
-    # Create a new set to be filled with connected points + original points
-    new_points = set(points)
 
-    for point in points:
-        for conn in graph.get_neighbours(point, EPSILON):
-            new_points.add(conn)
-        
-    # Now define a recursive base case
-    if new_points == points:
-        # There are no new points to be found so we have our solution
-        return new_points
-    else:
-        # Otherwise recursively call the function with the new points
-        return epsilon_closure(graph, new_points)
+#-----------------------------------------------------------------------------------------------------------#
 
-def move(points, NFA, value):
-    # Given a set of possible points compute the next set of possible points
-    # for a traversal value
-    new_points = set()
-    for point in points:
-        for conn in NFA.get_neighbours(point, value):
-            new_points.add(conn)
-    return new_points
+# Building the tables takes a while so the finished DFATable is saved to a cache
+# file and loaded on the next run. The cache is only used if it was made from
+# exactly the same language by the same version of this generator, anything else
+# (missing, stale or corrupt) just means the tables are built again
 
+# Increase this whenever a change to the generator changes the tables it makes
+GENERATOR_VERSION = 3
 
-def NFA_to_DFA(DFA, NFA, NFA_input_node):
-    
-    # The algorithm to create a DFA from an NFA involves traversing every path on the NFA at once
-    # taking the epsilon-closure at every stage.
-    # Example
-    # Starting with {0} the input node, take the epsilon-closure({0})
-    # Then for each character in the language calculate the set of points that can be reached
-    # Then take the epsilon closure of that and so on
+CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lexer_tables.bin')
+CACHE_MAGIC = b'LXTB'
 
-    # For each set of possible NFA positions create a DFA node referenced by a dictionary
-    # Dict:           set of NFA points       ---> DFA node
-    #            set_hash x where x is a set  --->   int
-    # Since sets are not hashable we define a function set_hash to turn them into unique hashable tuples
+# File layout (little endian):
+#   magic | format version | language hash (32 bytes) | crc32 of the rest |
+#   n_states | n_columns | length of symbols | length of keys |
+#   symbols (utf-8, classes seperated by a null) | keys (utf-8, one per line) |
+#   columns | transitions | accept
+# where columns, transitions and accept are raw 32 bit int arrays
+CACHE_HEADER = struct.Struct('<4sI32sI')
+CACHE_SIZES = struct.Struct('<IIII')
 
-    set_hash = lambda x: tuple(sorted(list(x)))
 
-    DFA_nodes = {}
+def language_hash(language):
+    # A hash of everything the tables depend on
+    h = hashlib.sha256()
+    h.update(str(GENERATOR_VERSION).encode())
+    for expression in language:
+        h.update(repr((expression['regex'], expression['key'])).encode())
+    return h.digest()
 
-    # Create a stack of NFA possiblilities to compute further from
-    # Implement with a set of tuple(set())'s
-    # For every element in here, elm, tuple(elm) will be in DFA_nodes
-    compute_stack = set()
 
+def _int_array_bytes(values):
+    # The raw little endian bytes of an array of ints
+    values = array('i', values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
 
-    # We start with the input node to the NFA and its epsilon-closure
-    DFA_in = epsilon_closure(NFA, {NFA_input_node})
-    # Add it to the computation stack
-    compute_stack.add(set_hash(DFA_in))
-    # create a DFA node for the current NFA possibility
-    DFA_in_node = DFA.add_node()
-    # and add this node to the DFA node dictionary
-    DFA_nodes[set_hash(DFA_in)] = DFA_in_node
 
+def _int_array_from(data):
+    # The inverse of _int_array_bytes
+    values = array('i')
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
 
-    while len(compute_stack) != 0: # While the computation stack is not empty
 
-        # get a random possibility to compute its links
-        current_DFA_pos = set(compute_stack.pop())
+def save_tables(table, language, filename=CACHE_FILE):
+    # Write the tables to the cache file
+    symbols = '\0'.join(table.symbols).encode('utf-8')
+    keys = '\n'.join(table.keys).encode('utf-8')
 
-        # get the assigned node from the dict
-        current_DFA_node = DFA_nodes[set_hash(current_DFA_pos)]
+    body = CACHE_SIZES.pack(table.n_states, table.n_columns, len(symbols), len(keys)) \
+           + symbols + keys \
+           + _int_array_bytes(table.columns) \
+           + _int_array_bytes(table.transitions) \
+           + _int_array_bytes(table.accept)
 
-        #print('\nWe calculating with DFA_node ',current_DFA_node)
+    header = CACHE_HEADER.pack(CACHE_MAGIC, GENERATOR_VERSION, language_hash(language),
+                               zlib.crc32(body))
 
-        # For each of the characters in the character set calculate a possible NFA state
-        for character in character_set:
+    # Write to a temporary file first so a half written cache is never seen
+    temp_filename = filename + '.tmp' + str(os.getpid())
+    with open(temp_filename, 'wb') as f:
+        f.write(header + body)
+    os.replace(temp_filename, filename)
 
-            new_pos = epsilon_closure(NFA, move(current_DFA_pos, NFA, character))
 
-            if not new_pos == set(): # If the set is non empty
-                new_pos_tup = set_hash(new_pos)
-                if DFA_nodes.get(new_pos_tup, None) is None:
-                    #print('_'+character+'_', end='')
-                    # This possibility has never been seen before
-                    # Create a new DFA node to refer to it
-                    new_node = DFA.add_node()
-                    # and add it to the dictionary
-                    DFA_nodes[new_pos_tup] = new_node
+def load_tables(language, filename=CACHE_FILE):
+    # Read the tables from the cache file, returns None if there isn't a
+    # usable cache for this language
+    try:
+        with open(filename, 'rb') as f:
+            data = f.read() # one bulk read, everything below just slices it
+    except OSError:
+        return None
 
-                    print(new_node, end='')
+    if len(data) < CACHE_HEADER.size + CACHE_SIZES.size:
+        return None
 
-                    # Now connect it to the node it was connected to
-                    DFA.add_edge(current_DFA_node, new_node, character)
+    magic, version, spec_hash, checksum = CACHE_HEADER.unpack_from(data, 0)
+    if magic != CACHE_MAGIC or version != GENERATOR_VERSION or spec_hash != language_hash(language):
+        return None # stale
 
-                    # Now add it to the computation stack so that its connections can be computed
-                    compute_stack.add(new_pos_tup)
-                else:
-                    #print(character, end='')
-                    # This node has been seen before so simply add a connection to it
-                    # Get the posibility that it points to by DFA_nodes
-                    points_to = DFA_nodes[new_pos_tup]
-                    DFA.add_edge(current_DFA_node, points_to, character)
+    body = memoryview(data)[CACHE_HEADER.size:]
+    if zlib.crc32(body) != checksum:
+        return None # corrupt
 
+    n_states, n_columns, symbols_len, keys_len = CACHE_SIZES.unpack_from(body, 0)
+    i = CACHE_SIZES.size
+    symbols = bytes(body[i:i+symbols_len]).decode('utf-8').split('\0')
+    i += symbols_len
+    keys = bytes(body[i:i+keys_len]).decode('utf-8').split('\n')
+    i += keys_len
 
-    return DFA_nodes
+    if len(symbols) != n_columns or len(body) != i + 4 * (256 + n_states * n_columns + n_states):
+        return None
 
+    table = DFATable(n_states, symbols, keys)
+    table.columns = _int_array_from(body[i:i+4*256])
+    i += 4*256
+    table.transitions = _int_array_from(body[i:i+4*n_states*n_columns])
+    i += 4*n_states*n_columns
+    table.accept = _int_array_from(body[i:])
 
+    return table
+
+
+def get_tables(language=language, filename=CACHE_FILE):
+    # Returns the DFATable for the language, from the cache if possible
+    table = load_tables(language, filename)
+
+    if table is None:
+        table = build_tables(language)
+        try:
+            save_tables(table, language, filename)
+        except OSError:
+            pass # Not being able to write the cache only makes the next run slower
+
+    return table
 
 
 
@@ -657,24 +1179,22 @@ def NFA_to_DFA(DFA, NFA, NFA_input_node):
                  
 
 if __name__=='__main__':
-    # Create the NFA graph
-    NFA = Graph()
+    print('Computing the NFA...')
+    NFA, input_node, output_nodes = build_NFA(language)
+    print('\tNFA nodes:', NFA.size)
 
-    input_node = NFA.add_node()
-    
-    for expression in language:
-        print('Computing the NFA for',expression['regex'])
-        cur_output_node = NFA.add_node()
-        expression['output_node'] = cur_output_node
-        regex = expression['regex']
-        regex_to_NFA(regex, NFA, input_node, cur_output_node)
+    classes = alphabet_classes(language)
+    print('\tCharacter classes:', len(classes))
 
+    print('NFA to DFA...')
     DFA = Graph()
+    DFA_nodes = NFA_to_DFA(DFA, NFA, input_node, classes)
+    accepts = DFA_accepts(DFA_nodes, output_nodes)
+    print('\tDFA nodes:', DFA.size)
 
-    print('NFA to DFA...')
-    print('Creating DFA nodes')
-    w = NFA_to_DFA(DFA, NFA, input_node)
-    print('')
+    print('Minimizing the DFA...')
+    table = minimize_DFA(DFA, 0, accepts, [expression['key'] for expression in language], classes)
+    print('\tMinimal DFA states:', table.n_states)
 
-    
-    
\ No newline at end of file
+    print('Saving the tables to', CACHE_FILE)
+    save_tables(table, language)
@@ -0,0 +1,81 @@
+
+# Optimization passes over the Abstract Syntax Tree
+#
+# These run between parsers.parse_program and generate_code. Each pass is a
+# function that takes a Function from the tree and returns the (possibly
+# changed) Function, so the passes can be run on each function as it is
+# parsed when compiling a stream of functions
+
+#----------------------------------------------------------------------------------------#
+
+import ast
+from definitions import wrap_int, UNARY_FOLDS
+from passtimer import NULL_TIMER
+
+#----------------------------------------------------------------------------------------#
+
+
+class PassManager:
+    # Holds a list of named passes and runs them over every function of a program,
+    # each pass is timed under its name by timer (a passtimer.PassTimer)
+
+    def __init__(self, passes=(), timer=None):
+        self.passes = list(passes) # list of (name, function)
+        self.timer = timer if timer is not None else NULL_TIMER
+
+    def add(self, name, function):
+        self.passes.append((name, function))
+
+    def run_function(self, function):
+        for name, optimization in self.passes:
+            with self.timer.phase(name):
+                function = optimization(function)
+        return function
+
+    def run(self, program):
+        # Returns a new program whose functions are optimized as they are asked for
+        return ast.Program(self.run_function(f) for f in program.functions)
+
+
+#----------------------------------------------------------------------------------------#
+
+# Constant folding
+# An expression whose value is known at compile time (eg. -~!5) is replaced by
+# a single Integer with its value, using C's 32 bit int arithmetic (definitions.UNARY_FOLDS)
+
+
+def fold_expression(expression):
+    # Returns the expression with any constant parts folded
+
+    # Walk down the chain of unary operators (without recursing)
+    operators = []
+    bottom = expression
+    while isinstance(bottom, ast.UnaryOpExpression):
+        operators.append(bottom.unary_op.operation)
+        bottom = bottom.expression
+
+    if len(operators) == 0 or not isinstance(bottom, ast.Integer):
+        return expression # nothing to fold
+
+    # Apply the operators from the bottom up
+    value = wrap_int(int(bottom.value))
+    for operation in reversed(operators):
+        value = UNARY_FOLDS[operation](value)
+
+    return ast.Integer(str(value))
+
+
+def fold_constants(function):
+    statement = function.statement
+    statement.expression = fold_expression(statement.expression)
+    return function
+
+
+#----------------------------------------------------------------------------------------#
+
+# The passes run by default, in order
+DEFAULT_PASSES = [('constant folding', fold_constants)]
+
+def optimize(program, timer=None):
+    # Run the default passes over a program
+    return PassManager(DEFAULT_PASSES, timer).run(program)
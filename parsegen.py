@@ -0,0 +1,392 @@
+############################################### ParseGen.py #################################################
+
+# Generates a table driven LL(1) parser from the grammar in BNR_rules.txt
+#
+# The rules are read in the same BNF they are written in
+#   <statement> ::= "return" <exp> ";"
+#   <unary_op> ::= "!" | "~" | "-"
+#   <program> ::= {<function>}*
+# --> <name> is a nonterminal, if it has no rule of its own it is a kind of
+#     token from the lexer (definitions.TOKEN_CLASSES, eg. <int> is an INTEGER)
+# --> "text" is a token that must be exactly text
+# --> {...}* repeats zero or more times, it becomes a new nonterminal {...}*
+#     with the rules  {...}* ::= ... {...}*  |  (nothing)
+#
+# From the rules the FIRST set of each nonterminal (the tokens it can start
+# with) and its FOLLOW set (the tokens that can come after it) are worked out,
+# which give the parse table. For each nonterminal and next token the table
+# holds the one production to use, if two productions would fit the grammar
+# isn't LL(1) and it is an error
+#
+# The parser is then one loop over a stack of symbols (see parse), the only
+# code for each rule is a builder that makes its node of the tree. A new rule
+# in the grammar is just new rows in the table
+
+import os, re
+from array import array
+from collections import deque
+
+import definitions
+
+#-----------------------------------------------------------------------------------------------------------#
+
+GRAMMAR_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'BNR_rules.txt')
+
+END = '$' # the terminal for the end of the tokens
+
+# The pieces of a rule
+BNF_TOKEN = re.compile(r'<[^>]+>|"[^"]*"|::=|\||\{|\}\*|\S')
+
+
+def read_rules(filename=GRAMMAR_FILE):
+    # Returns a dict of nonterminal -> list of productions (each a list of
+    # symbols) in the order they are written. A line without ::= carries on
+    # the rule before it
+    text = []
+    with open(filename) as f:
+        for line in f:
+            if '::=' in line or len(text) == 0:
+                text.append(line)
+            else:
+                text[-1] += ' ' + line
+
+    rules = {}
+    for rule in text:
+        pieces = BNF_TOKEN.findall(rule)
+        if len(pieces) == 0:
+            continue
+        assert len(pieces) >= 2 and pieces[1] == '::=', 'Bad rule '+repr(rule)
+        add_rule(rules, pieces[0], pieces[2:])
+    return rules
+
+
+def add_rule(rules, name, pieces):
+    # Add the productions in pieces (split at the top level |'s) to rules[name],
+    # turning any {...}* into a new nonterminal
+    rules.setdefault(name, [])
+    productions = [[]]
+    i = 0
+    while i < len(pieces):
+        piece = pieces[i]
+        if piece == '|':
+            productions.append([])
+        elif piece == '{':
+            # Find the matching }*
+            depth = 1
+            j = i + 1
+            while depth != 0:
+                assert j < len(pieces), 'No }* for { in the rule for '+name
+                depth += {'{': 1, '}*': -1}.get(pieces[j], 0)
+                j += 1
+            inner = pieces[i+1:j-1]
+            repeated = '{' + ' '.join(inner) + '}*'
+            if not repeated in rules:
+                add_rule(rules, repeated, inner)
+                rules[repeated] = [production + [repeated] for production in rules[repeated]] + [[]]
+            productions[-1].append(repeated)
+            i = j
+            continue
+        else:
+            assert piece[0] in '<"', 'Unexpected '+repr(piece)+' in the rule for '+name
+            productions[-1].append(piece)
+        i += 1
+    rules[name].extend(productions)
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+# FIRST and FOLLOW sets
+
+
+def is_repetition(symbol):
+    return symbol.endswith('}*')
+
+
+def first_of(symbols, first, nullable):
+    # The FIRST set of a list of symbols and whether they can all be empty
+    result = set()
+    for symbol in symbols:
+        if symbol in first:
+            result |= first[symbol]
+            if not symbol in nullable:
+                return result, False
+        else:
+            result.add(symbol) # a terminal
+            return result, False
+    return result, True
+
+
+def first_sets(rules):
+    # Returns the FIRST set of every nonterminal and the set of nonterminals
+    # that can be empty, going over the rules until nothing changes
+    first = {name: set() for name in rules}
+    nullable = set()
+    changed = True
+    while changed:
+        changed = False
+        for name, productions in rules.items():
+            for production in productions:
+                symbols, empty = first_of(production, first, nullable)
+                if not symbols <= first[name]:
+                    first[name] |= symbols
+                    changed = True
+                if empty and not name in nullable:
+                    nullable.add(name)
+                    changed = True
+    return first, nullable
+
+
+def follow_sets(rules, first, nullable, start):
+    # Returns the FOLLOW set of every nonterminal
+    follow = {name: set() for name in rules}
+    follow[start].add(END)
+    changed = True
+    while changed:
+        changed = False
+        for name, productions in rules.items():
+            for production in productions:
+                for i, symbol in enumerate(production):
+                    if not symbol in rules:
+                        continue
+                    symbols, empty = first_of(production[i+1:], first, nullable)
+                    if empty:
+                        symbols = symbols | follow[name]
+                    if not symbols <= follow[symbol]:
+                        follow[symbol] |= symbols
+                        changed = True
+    return follow
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+# The parse table
+#
+# Every symbol is numbered so the parser's stack is a list of ints
+#   0 .. n_terminals-1                   terminals (the last one is END)
+#   n_terminals .. +n_nonterminals-1     nonterminals
+#   after that                           'reduce production p' markers
+# table[nonterminal * n_terminals + terminal] is the production to use (-1 for none)
+
+
+class ParseTable():
+
+    def __init__(self, rules, start):
+        first, nullable = first_sets(rules)
+        follow = follow_sets(rules, first, nullable, start)
+
+        self.nonterminals = list(rules)
+        terminals = []
+        for productions in rules.values():
+            for production in productions:
+                for symbol in production:
+                    if not symbol in rules and not symbol in terminals:
+                        terminals.append(symbol)
+        self.terminals = terminals + [END]
+        self.n_terminals = len(self.terminals)
+
+        # How a token is turned into a terminal, by its exact text first and then its kind
+        self.literals = {}
+        self.kinds = {}
+        # and the other way, the text or kind of each terminal (None for the other)
+        self.texts = []
+        self.kinds_of = []
+        for number, terminal in enumerate(terminals):
+            if terminal.startswith('"'):
+                self.literals[terminal[1:-1]] = number
+                self.texts.append(terminal[1:-1])
+                self.kinds_of.append(None)
+            else:
+                assert terminal in definitions.TOKEN_CLASSES, 'No rule or token class for '+terminal
+                self.kinds[definitions.TOKEN_CLASSES[terminal]] = number
+                self.texts.append(None)
+                self.kinds_of.append(definitions.TOKEN_CLASSES[terminal])
+
+        numbers = {symbol: number for number, symbol in enumerate(self.terminals)}
+        for number, name in enumerate(self.nonterminals):
+            numbers[name] = self.n_terminals + number
+        self.numbers = numbers
+        self.reduce_base = self.n_terminals + len(self.nonterminals)
+
+        # The productions as (nonterminal, symbols), and what expanding each one
+        # pushes on the stack (its reduce marker then its symbols reversed).
+        # A production that is empty or a single terminal is a leaf (the number
+        # of terminals it has, -1 for the others), when it is chosen the
+        # terminal must be the next token so it is read and built straight
+        # away rather than going through the stack
+        self.productions = []
+        self.expansions = []
+        self.leaves = []
+        self.table = array('h', [-1] * (len(self.nonterminals) * self.n_terminals))
+        for row, name in enumerate(self.nonterminals):
+            for production in rules[name]:
+                p = len(self.productions)
+                self.productions.append((name, tuple(production)))
+                self.expansions.append((self.reduce_base + p,) +
+                                       tuple(numbers[symbol] for symbol in reversed(production)))
+                if len(production) == 0 or (len(production) == 1 and not production[0] in rules):
+                    self.leaves.append(len(production))
+                else:
+                    self.leaves.append(-1)
+
+                symbols, empty = first_of(production, first, nullable)
+                if empty:
+                    symbols = symbols | follow[name]
+                for terminal in symbols:
+                    entry = row * self.n_terminals + numbers[terminal]
+                    assert self.table[entry] in (-1, p), \
+                        'The grammar is not LL(1), '+name+' has two productions for '+terminal
+                    self.table[entry] = p
+
+        self.start = numbers[start]
+
+        # (builder, number of symbols) of each production for each dict of builders used
+        self.reducer_lists = {}
+
+    def reducers(self, builders):
+        # The builder of each production (None for repetitions) and how many values it takes
+        if not id(builders) in self.reducer_lists:
+            reducers = []
+            for name, production in self.productions:
+                if is_repetition(name):
+                    reducers.append((None, len(production)))
+                else:
+                    assert name in builders, 'No builder for '+name
+                    reducers.append((builders[name], len(production)))
+            self.reducer_lists[id(builders)] = (builders, reducers) # holding builders keeps the id in use
+        return self.reducer_lists[id(builders)][1]
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+# The driver
+
+
+def parse(genrt, table, builders, start=None, tokens=None, subparsers=None):
+    # Parses tokens from genrt (a tokenize.TokenGenerator or anything with
+    # next(), peak() and peak_kind()) returning what the builder of the start
+    # nonterminal made
+    #
+    # builders[name] is given the list of values of a production of name (the
+    # text of each terminal and what was built for each nonterminal) and returns
+    # its value. Repetitions are built into a deque of their values
+    #
+    # If tokens is a list the text of each token read is added to it
+    #
+    # subparsers[name] is a function that parses the whole of a nonterminal
+    # itself, it is called as subparsers[name](genrt, tokens) instead of
+    # expanding name and what it returns is the value of name
+    if start is None:
+        start = table.start
+    else:
+        start = table.numbers[start]
+
+    n_terminals = table.n_terminals
+    reduce_base = table.reduce_base
+    parse_table = table.table
+    expansions = table.expansions
+    leaves = table.leaves
+    literals = table.literals
+    kinds = table.kinds
+    texts = table.texts
+    kinds_of = table.kinds_of
+    reducers = table.reducers(builders)
+    peak = genrt.peak
+    record = tokens.append if tokens is not None else None
+    subparse = {}
+    if subparsers is not None:
+        subparse = {table.numbers[name]: subparser for name, subparser in subparsers.items()}
+
+    stack = [start]
+    values = []
+    terminal = -2 # the terminal number of the next token, -2 when it needs working out
+
+    while stack:
+        symbol = stack.pop()
+
+        if symbol < n_terminals:
+            # A terminal, it has to be the next token. If the token hasn't been
+            # looked at yet it is just checked against the terminal's text (or
+            # kind) rather than worked out, which saves reading its text twice
+            if terminal != -2:
+                assert symbol == terminal, 'Expected '+table.terminals[symbol]+' but found '+repr(peak())
+                lexeme = next(genrt)
+            elif texts[symbol] is not None:
+                lexeme = next(genrt, None)
+                assert lexeme == texts[symbol], \
+                    'Expected '+table.terminals[symbol]+' but found '+repr(lexeme)
+            else:
+                assert genrt.peak_kind() == kinds_of[symbol], \
+                    'Expected '+table.terminals[symbol]+' but found '+repr(peak())
+                lexeme = next(genrt)
+                assert not lexeme in literals, 'Expected '+table.terminals[symbol]+' but found '+repr(lexeme)
+            values.append(lexeme)
+            if record is not None:
+                record(lexeme)
+            terminal = -2
+
+        elif symbol < reduce_base:
+            if symbol in subparse:
+                # Parsed by its own function, which reads its tokens
+                values.append(subparse[symbol](genrt, tokens))
+                terminal = -2
+                continue
+
+            # A nonterminal, the table says which production to expand it to
+            if terminal == -2:
+                # By its text if it is a literal in the grammar or else by its
+                # kind (-1 if the grammar has no use for it)
+                lexeme = peak()
+                if lexeme is None:
+                    terminal = n_terminals - 1 # END
+                else:
+                    terminal = literals.get(lexeme, -1)
+                    if terminal == -1:
+                        terminal = kinds.get(genrt.peak_kind(), -1)
+
+            p = parse_table[(symbol - n_terminals) * n_terminals + terminal] if terminal != -1 else -1
+            assert p != -1, 'Unexpected '+repr(peak())+' in '+table.nonterminals[symbol - n_terminals]
+            leaf = leaves[p]
+            if leaf == -1:
+                stack.extend(expansions[p])
+                continue
+
+            # A leaf, read its terminal (if it has one) and build it below
+            if leaf == 1:
+                lexeme = next(genrt)
+                values.append(lexeme)
+                if record is not None:
+                    record(lexeme)
+                terminal = -2
+            symbol = reduce_base + p
+
+        if symbol >= reduce_base:
+            # The production is finished, build its value from the last n values
+            builder, n = reducers[symbol - reduce_base]
+            if n == 0:
+                children = []
+            elif n == 1:
+                children = [values.pop()]
+            else:
+                children = values[-n:]
+                del values[-n:]
+            if builder is not None:
+                values.append(builder(children))
+            elif n == 0:
+                values.append(deque()) # the end of a repetition
+            else:
+                repeated = children[-1]
+                repeated.appendleft(children[0] if n == 2 else children[:-1])
+                values.append(repeated)
+
+    return values[0]
+
+
+# The tables are generated the first time they are needed
+_tables = {}
+
+def get_table(filename=GRAMMAR_FILE):
+    # The ParseTable for a grammar file, starting at its first rule
+    if not filename in _tables:
+        rules = read_rules(filename)
+        _tables[filename] = ParseTable(rules, next(iter(rules)))
+    return _tables[filename]
@@ -14,114 +14,136 @@
 
 from ast import Program, Function, Statement, UnaryOpExpression, Integer, UnaryOp
 import definitions
+import parsegen
 
 #----------------------------------------------------------------------------------------#
 
 def parse_program(genrt):
     # The BNR defines a program as just a function
     # <program> ::= [<function>]*
-    functions = []
-    while not genrt.peak() is None:
-        functions.append(parse_function(genrt))
+    functions = list(parse_functions(genrt))
 
     # Create a new program and return it
     new_program = Program(functions)
     return new_program
 
-#----------------------------------------------------------------------------------------#
-
-
-def parse_function(genrt):
-    # BNR: <function> ::= "int" <id> "(" ")" "{" <statement> "}"
-
-    # assert that the return type is 'int'
-    return_type = next(genrt)
-    assert return_type == 'int'
-
-    # get the function id
-    id = next(genrt)
-
-    # assert the '(', ')' and '{' tokens
-    assert next(genrt) == '('
-    assert next(genrt) == ')'
-    assert next(genrt) == '{'
-
-    # get the statement parse
-    statement = parse_statement(genrt)
-
-    # assert the final '}'
-    assert next(genrt) == '}'
-
-    # create the new function and return it
-    new_function = Function(id, statement)
-    return new_function
-    
 
+def parse_functions(genrt):
+    # Yields each function of the program as soon as it has been parsed
+    # so the caller can deal with one function at a time
+    while not genrt.peak() is None:
+        yield parse_function(genrt)
 
 #----------------------------------------------------------------------------------------#
 
+# Functions are parsed by the LL(1) parser generated from BNR_rules.txt (see
+# parsegen.py), BUILDERS makes the node of the tree for each rule from the
+# values of the symbols of the production that was used
 
+def build_program(children):
+    # <program> ::= {<function>}*
+    return Program(children[0])
 
-def parse_statement(genrt):
-    # BNR <statement> ::= "return" <exp> ";"
-
-    # assert the return part
-    assert next(genrt) == 'return'
-
-    # get the expression
-    expression = parse_expression(genrt)
+def build_function(children):
+    # <function> ::= "int" <id> "(" ")" "{" <statement> "}"
+    return Function(children[1], children[5])
 
-    # assert the semicolon
-    assert next(genrt) == ';'
+def build_statement(children):
+    # <statement> ::= "return" <exp> ";"
+    return Statement(children[1])
 
-    # create and return the statement
-    new_statement = Statement(expression)
-    return new_statement
-
-#----------------------------------------------------------------------------------------#
-
-
-
-def parse_expression(genrt):
+def build_expression(children):
     # <exp> ::= <unary_op> <exp> | <int>
-    
-    # first consider the next token
-    next_token = genrt.peak()
-
-    # is the next token a unary op
-    if next_token in definitions.UNARY_OPS:
-        # Then the form must be
-        # <exp> ::= <unary_op> <exp>
-        unary_op = parse_unaryop(genrt)
-        expression = parse_expression(genrt)
-        new_expression = UnaryOpExpression(unary_op, expression)
-        #new_expression = Expression(new_expression_child)
-    else:
-        # then the form must be 
-        # <exp> ::= <int>
-        value = next(genrt)
-
-        # create and return the expression
-        new_expression = Integer(value=value)
-
-    return new_expression
+    if len(children) == 2:
+        return UnaryOpExpression(children[0], children[1])
+    return Integer(value=children[0])
 
+def build_unaryop(children):
+    # <unary_op> ::= "!" | "~" | "-"
+    return UnaryOp(children[0])
 
+BUILDERS = {'<program>': build_program,
+            '<function>': build_function,
+            '<statement>': build_statement,
+            '<exp>': build_expression,
+            '<unary_op>': build_unaryop}
 
 
 #----------------------------------------------------------------------------------------#
 
+# Expressions are parsed by their own operator precedence (Pratt) parser rather
+# than the LL(1) table, it keeps the operators waiting for their operand on an
+# explicit stack so any depth of nesting (eg. -~-~-~...5) uses the same amount
+# of python stack, and it handles infix operators by their binding powers
+# (definitions.INFIX_BINDING_POWER) which an LL(1) grammar can't express
+#
+# An infix node is made by builders['<infix>'] from [left, operator, right],
+# there are no infix operators in the language yet so BUILDERS has none
 
-def parse_unaryop(genrt):
-    # <unary_op> ::= "!" | "~" | "-"
+INTEGER_KIND = definitions.TOKEN_CLASSES['<int>']
+
+def parse_expression(genrt, tokens=None, builders=BUILDERS):
+    # <exp> ::= <unary_op> <exp> | <int>
+    #
+    # Each prefix operator is pushed with its binding power until an operand is
+    # reached. The waiting operators with a higher binding power than the left
+    # power of the infix operator after the operand are then applied to it,
+    # innermost first. If there is an infix operator it waits on the stack
+    # with what has been built so far as its left side and its right power,
+    # and the next operand is parsed the same way
+    prefix_power = definitions.PREFIX_BINDING_POWER
+    infix_power = definitions.INFIX_BINDING_POWER
+    build_expression, build_unaryop = builders['<exp>'], builders['<unary_op>']
+    record = tokens.append if tokens is not None else None
+
+    stack = [] # (binding power, left side or None for a prefix operator, operator)
+    while True:
+        # <unary_op> <exp>
+        lexeme = genrt.peak()
+        while lexeme in prefix_power:
+            next(genrt)
+            if record is not None:
+                record(lexeme)
+            stack.append((prefix_power[lexeme], None, build_unaryop([lexeme])))
+            lexeme = genrt.peak()
+
+        # <int>
+        assert genrt.peak_kind() == INTEGER_KIND, 'Expected <int> but found '+repr(lexeme)
+        next(genrt)
+        if record is not None:
+            record(lexeme)
+        expression = build_expression([lexeme])
+
+        # -1 when no infix operator follows, so everything waiting is applied
+        lexeme = genrt.peak()
+        left_power = infix_power[lexeme][0] if lexeme in infix_power else -1
+        while len(stack) != 0 and stack[-1][0] > left_power:
+            power, left, operator = stack.pop()
+            if left is None:
+                expression = build_expression([operator, expression])
+            else:
+                expression = builders['<infix>']([left, operator, expression])
+
+        if left_power == -1:
+            return expression
+
+        next(genrt)
+        if record is not None:
+            record(lexeme)
+        stack.append((infix_power[lexeme][1], expression, lexeme))
+
+
+SUBPARSERS = {'<exp>': parse_expression}
 
-    # just get the operator as a token
-    operator = next(genrt)
-    
-    # create and return the new unaryop
-    new_unaryop = UnaryOp(operator)
-    return new_unaryop
 
+def parse_function(genrt):
+    # BNR: <function> ::= "int" <id> "(" ")" "{" <statement> "}"
+    # The tokens it was parsed from are kept with it (see codecache.py)
+    tokens = []
+    new_function = parsegen.parse(genrt, parsegen.get_table(), BUILDERS, '<function>', tokens,
+                                  SUBPARSERS)
+    new_function.tokens = tokens
+    return new_function
 
 
 #----------------------------------------------------------------------------------------#
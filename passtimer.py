@@ -0,0 +1,148 @@
+############################################### PassTimer.py ################################################
+
+# Where the compiler spends its time (compiler.py --time-passes)
+#
+# Each part of the compiler runs inside a phase
+#     with timer.phase('parse'):
+#         ...
+# which adds up the wall clock and CPU time spent in it and how many times it
+# ran. Phases can be inside each other (eg. the optimizer passes run lazily
+# while the code is being generated), the time of an inner phase only counts
+# for the inner phase so the phases add up to the total
+#
+# Counters (tokens, DFA states, ...) are added with timer.count(name, n)
+#
+# The report is a table or JSON
+#
+# When nothing is being timed a NullTimer is passed instead, which does nothing
+
+import os, time, json, threading
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+class Phase():
+    # The context manager returned by PassTimer.phase
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.timer.start(self.name)
+
+    def __exit__(self, *exception):
+        self.timer.stop()
+
+
+class PassTimer():
+
+    enabled = True
+
+    def __init__(self):
+        # name -> [wall seconds, cpu seconds, calls] in the order they first ran
+        self.phases = {}
+        self.counters = {}
+
+        # The running phases, each [name, wall start, cpu start, wall of inner phases, cpu of inner phases]
+        self.running = []
+
+        # Phases timed on other threads are added with add (see compiler.compile_files)
+        self.lock = threading.Lock()
+
+    def phase(self, name):
+        return Phase(self, name)
+
+    def start(self, name):
+        self.running.append([name, time.perf_counter(), time.process_time(), 0.0, 0.0])
+
+    def stop(self):
+        name, wall_start, cpu_start, inner_wall, inner_cpu = self.running.pop()
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        self.add(name, wall - inner_wall, cpu - inner_cpu)
+
+        # Take this phase's time off the phase it was inside
+        if len(self.running) != 0:
+            self.running[-1][3] += wall
+            self.running[-1][4] += cpu
+
+    def add(self, name, wall, cpu, calls=1):
+        with self.lock:
+            totals = self.phases.setdefault(name, [0.0, 0.0, 0])
+            totals[0] += wall
+            totals[1] += cpu
+            totals[2] += calls
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, results):
+        # Add the results (from to_dict) of another timer, eg. from a worker process
+        for name, phase in results['phases'].items():
+            self.add(name, phase['wall'], phase['cpu'], phase['calls'])
+        for name, n in results['counters'].items():
+            self.count(name, n)
+
+    def to_dict(self):
+        return {'phases': {name: {'wall': wall, 'cpu': cpu, 'calls': calls}
+                           for name, (wall, cpu, calls) in self.phases.items()},
+                'counters': dict(self.counters)}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def report(self):
+        # A table of the phases (slowest first) and the counters
+        total_wall = sum(wall for wall, cpu, calls in self.phases.values())
+        total_cpu = sum(cpu for wall, cpu, calls in self.phases.values())
+
+        lines = ['%-28s %10s %7s %10s %8s' % ('phase', 'wall (s)', 'wall %', 'cpu (s)', 'calls')]
+        for name, (wall, cpu, calls) in sorted(self.phases.items(), key=lambda item: -item[1][0]):
+            percent = 100 * wall / total_wall if total_wall != 0 else 0
+            lines.append('%-28s %10.6f %6.1f%% %10.6f %8d' % (name, wall, percent, cpu, calls))
+        lines.append('%-28s %10.6f %6.1f%% %10.6f' % ('total', total_wall, 100, total_cpu))
+
+        if len(self.counters) != 0:
+            lines.append('')
+            lines.append('%-28s %10s' % ('counter', 'value'))
+            for name, n in self.counters.items():
+                if isinstance(n, float):
+                    lines.append('%-28s %10.1f' % (name, n))
+                else:
+                    lines.append('%-28s %10d' % (name, n))
+        return '\n'.join(lines)
+
+
+class NullPhase():
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exception):
+        pass
+
+
+class NullTimer():
+    # Stands in for a PassTimer when nothing is being timed
+
+    enabled = False
+    null_phase = NullPhase()
+
+    def phase(self, name):
+        return self.null_phase
+
+    def add(self, name, wall, cpu, calls=1):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def children_cpu():
+    # The CPU time used by finished child processes (eg. the assembler)
+    times = os.times()
+    return times.children_user + times.children_system
@@ -0,0 +1,159 @@
+
+# Peephole optimization of the instructions made by the code generator
+#
+# The instructions (as tuples, see emitter.py) are passed through one at a time.
+# After each one is added the rules are tried on the last few instructions (the
+# window), if a rule matches, the window is replaced by what the rule returns
+# and the replacement is passed through again so it can match more rules.
+#
+# Each rule is (name, window size, function). The function is given the list of
+# instructions in the window and the instructions still to come (the next one
+# last, see flags_used) and returns the list to replace the window with or None
+# if it doesn't match. Rules must make the code shorter or simpler so that
+# they can't keep matching forever. The number of times each rule matched is
+# counted in hits.
+
+#----------------------------------------------------------------------------------------#
+
+import re
+
+from definitions import UNARY_FOLDS
+
+#----------------------------------------------------------------------------------------#
+
+
+class PeepholeOptimizer:
+
+    name = 'peephole'
+
+    def __init__(self, rules=None):
+        if rules is None:
+            rules = RULES
+        self.rules = list(rules)
+        self.hits = {name: 0 for name, size, rule in self.rules}
+
+    def run(self, instructions):
+        # Returns the optimized list of instructions
+        output = []
+        pending = list(reversed(instructions)) # next instruction at the end
+
+        while len(pending) != 0:
+            output.append(pending.pop())
+
+            for name, size, rule in self.rules:
+                if len(output) < size:
+                    continue
+                replacement = rule(output[-size:], pending)
+                if replacement is not None:
+                    # Take the window off and pass the replacement through again
+                    del output[-size:]
+                    pending.extend(reversed(replacement))
+                    self.hits[name] += 1
+                    break
+
+        return output
+
+
+#----------------------------------------------------------------------------------------#
+
+# Helpers for writing rules
+
+# The instructions that set the flags and the ones that leave them alone
+# (anything else is assumed to need them)
+WRITES_FLAGS = {'add', 'sub', 'adc', 'sbb', 'and', 'or', 'xor', 'cmp', 'test',
+                'neg', 'inc', 'dec', 'imul', 'shl', 'shr', 'sar'}
+KEEPS_FLAGS = {'mov', 'not', 'push', 'pop', 'lea', 'movzx', 'movsx', 'cdq', 'nop'}
+
+INTEGER = re.compile(r'-?[0-9]+$')
+
+
+def reads_flags(instruction):
+    # Does the instruction use the flags set by the instructions before it
+    op = instruction[0]
+    return op in ('adc', 'sbb') or op.startswith('set') or op.startswith('cmov') \
+           or (op.startswith('j') and op != 'jmp')
+
+def flags_used(following):
+    # Could the flags as they are now be read by the instructions that come
+    # after (following has the next instruction last, as in PeepholeOptimizer.run)
+    #
+    # The instructions are looked at until one sets the flags or the code stops
+    # running straight through. Nothing reads the flags left by a function
+    # after its ret, but at a label or jump (or the end of what is known) they
+    # might be so they count as used
+    for instruction in reversed(following):
+        op = instruction[0]
+        if reads_flags(instruction):
+            return True
+        if op in WRITES_FLAGS or op == 'ret':
+            return False
+        if not op in KEEPS_FLAGS:
+            return True
+    return True
+
+def is_int(operand):
+    # Is the operand an integer constant
+    return INTEGER.match(operand) is not None
+
+def writes_only(instruction, register):
+    # Does the instruction set the register without using its old value
+    return instruction[0] == 'mov' and instruction[1] == register \
+           and not register in instruction[2]
+
+
+#----------------------------------------------------------------------------------------#
+
+# The rules
+
+def self_move(window, following):
+    # mov eax, eax does nothing
+    mov, = window
+    if mov[0] == 'mov' and mov[1] == mov[2]:
+        return []
+
+def overwritten_move(window, following):
+    # mov eax, 1 / mov eax, 2 -> mov eax, 2
+    first, second = window
+    if first[0] == 'mov' and writes_only(second, first[1]):
+        return [second]
+
+def dead_code(window, following):
+    # Nothing after a ret (or jmp) runs until the next label
+    first, second = window
+    if first[0] in ('ret', 'jmp') and second[0] != 'label':
+        return [first]
+
+def double_negation(window, following):
+    # neg eax / neg eax and not eax / not eax cancel out
+    # (as long as nothing after needs the flags from the neg)
+    first, second = window
+    if first == second and (first[0] == 'not' or first[0] == 'neg' and not flags_used(following)):
+        return []
+
+def fold_move(window, following):
+    # mov eax, 5 / neg eax -> mov eax, -5 (and not)
+    # (as long as nothing after needs the flags from the neg)
+    mov, op = window
+    if mov[0] == 'mov' and is_int(mov[2]) and op[0] in ('neg', 'not') and op[1] == mov[1] \
+       and (op[0] == 'not' or not flags_used(following)):
+        value = UNARY_FOLDS['-' if op[0] == 'neg' else '~'](int(mov[2]))
+        return [('mov', mov[1], str(value))]
+
+def fold_logical_not(window, following):
+    # mov eax, 5 / neg eax / sbb eax, eax / add eax, 1 -> mov eax, 0
+    # (the code made for !5)
+    mov, neg, sbb, add = window
+    register = mov[1]
+    if mov[0] == 'mov' and is_int(mov[2]) and neg == ('neg', register) \
+       and sbb == ('sbb', register, register) and add == ('add', register, '1') \
+       and not flags_used(following):
+        value = UNARY_FOLDS['!'](int(mov[2]))
+        return [('mov', register, str(value))]
+
+
+RULES = [('self move',        1, self_move),
+         ('overwritten move', 2, overwritten_move),
+         ('dead code',        2, dead_code),
+         ('double negation',  2, double_negation),
+         ('fold move',        2, fold_move),
+         ('fold logical not', 4, fold_logical_not)]
@@ -0,0 +1,192 @@
+
+# Register allocation
+#
+# The code generator doesn't pick registers itself, it asks the emitter for as
+# many virtual registers (%v0, %v1, ...) as it likes. Once a function's
+# instructions are finished the allocator replaces each virtual register by a
+# real x86 register, or by a slot on the stack (a spill) if there aren't enough.
+#
+# It uses linear scan allocation:
+# --> Work out the live interval of each virtual register, from the first to the
+#     last instruction it is used in (the code has no loops so this is exact)
+# --> Go through the intervals in order of where they start, keeping a list of
+#     the active ones (still live) each holding a register
+# --> Intervals that have ended give their register back
+# --> Give the new interval a free register, if there isn't one spill whichever
+#     of it and the active intervals ends last
+#
+# Caller saved registers (eax, ecx, edx) are used first since they cost nothing,
+# callee saved registers (ebx, esi, edi) have to be pushed and popped by the function.
+
+#----------------------------------------------------------------------------------------#
+
+CALLER_SAVED = ['eax', 'ecx', 'edx']
+CALLEE_SAVED = ['ebx', 'esi', 'edi']
+REGISTERS = CALLER_SAVED + CALLEE_SAVED
+
+# When anything is spilled this register is kept free for instructions that
+# would otherwise need two memory operands
+SCRATCH = 'edx'
+
+def is_virtual(operand):
+    return operand.startswith('%v')
+
+#----------------------------------------------------------------------------------------#
+
+
+class LinearScanAllocator:
+
+    name = 'register allocation'
+
+    def __init__(self, registers=REGISTERS):
+        self.registers = list(registers)
+        self.spills = 0 # how many virtual registers have been spilled in total
+
+    def run(self, instructions):
+        # Returns the instructions with real registers and any stack frame needed
+        intervals = self.live_intervals(instructions)
+        if len(intervals) == 0:
+            return instructions
+
+        assignment, slots = self.allocate(instructions, intervals, self.registers)
+        if slots != 0:
+            # Try again leaving the scratch register free
+            registers = [r for r in self.registers if r != SCRATCH]
+            assignment, slots = self.allocate(instructions, intervals, registers)
+            self.spills += slots
+
+        return self.rewrite(instructions, assignment, slots)
+
+    def live_intervals(self, instructions):
+        # Returns a dictionary of virtual register -> [first use, last use]
+        intervals = {}
+        for position, instruction in enumerate(instructions):
+            for operand in instruction[1:]:
+                if is_virtual(operand):
+                    if operand in intervals:
+                        intervals[operand][1] = position
+                    else:
+                        intervals[operand] = [position, position]
+        return intervals
+
+    def allocate(self, instructions, intervals, registers):
+        # Returns virtual register -> real register or stack slot number and the
+        # number of stack slots used
+
+        # Where each real register is used directly by the code
+        mentions = {register: [] for register in registers}
+        for position, instruction in enumerate(instructions):
+            for operand in instruction[1:]:
+                if operand in mentions:
+                    mentions[operand].append(position)
+
+        def can_use(register, vreg):
+            # The register is free for the whole interval of vreg, apart from
+            # an instruction at the end moving vreg into it
+            start, end = intervals[vreg]
+            for position in mentions[register]:
+                if start <= position <= end:
+                    if not (position == end and instructions[end] == ('mov', register, vreg)):
+                        return False
+            return True
+
+        def hint(vreg):
+            # The register a virtual register is moved into at its end (if any)
+            instruction = instructions[intervals[vreg][1]]
+            if instruction[0] == 'mov' and len(instruction) == 3 and instruction[2] == vreg:
+                return instruction[1]
+
+        def copied_from(vreg):
+            # The virtual register vreg starts as a copy of, if that one ends there
+            # (then they can share a register and the copy disappears)
+            start = intervals[vreg][0]
+            instruction = instructions[start]
+            if instruction[0] == 'mov' and instruction[1] == vreg and is_virtual(instruction[2]) \
+               and intervals[instruction[2]][1] == start:
+                return instruction[2]
+
+        assignment = {}
+        slots = 0
+        active = [] # (end, vreg) of intervals holding registers
+
+        for vreg in sorted(intervals, key=lambda v: intervals[v][0]):
+            start, end = intervals[vreg]
+
+            # Expire the intervals that have ended (including one that is only
+            # being copied into vreg)
+            source = copied_from(vreg)
+            active = [(e, v) for e, v in active if e > start or (e == start and v != source)]
+            in_use = {assignment[v] for e, v in active}
+            free = [r for r in registers if not r in in_use and can_use(r, vreg)]
+
+            if len(free) != 0:
+                preferred = hint(vreg)
+                if source is not None and assignment[source] in free:
+                    preferred = assignment[source]
+                assignment[vreg] = preferred if preferred in free else free[0]
+                active.append((end, vreg))
+                continue
+
+            # Spill whichever interval ends last
+            active.sort()
+            last_end, last = active[-1]
+            if last_end > end and can_use(assignment[last], vreg):
+                assignment[vreg] = assignment[last]
+                active[-1] = (end, vreg)
+                assignment[last] = slots
+            else:
+                assignment[vreg] = slots
+            slots += 1
+
+        return assignment, slots
+
+    def rewrite(self, instructions, assignment, slots):
+        # Put the real registers and stack slots into the instructions
+
+        def operand_for(operand):
+            if not is_virtual(operand):
+                return operand
+            place = assignment[operand]
+            if isinstance(place, int):
+                return 'dword [esp+'+str(4*place)+']'
+            return place
+
+        # The callee saved registers that need saving
+        used = set(place for place in assignment.values() if not isinstance(place, int))
+        saved = [register for register in CALLEE_SAVED if register in used]
+
+        prologue = [('push', register) for register in saved]
+        epilogue = [('pop', register) for register in reversed(saved)]
+        if slots != 0:
+            prologue.append(('sub', 'esp', str(4*slots)))
+            epilogue.insert(0, ('add', 'esp', str(4*slots)))
+
+        output = []
+        started = False
+        for instruction in instructions:
+            if instruction[0] == 'ret':
+                output.extend(epilogue)
+
+            operands = [operand_for(operand) for operand in instruction[1:]]
+            memory = [operand for operand in operands if operand.startswith('dword')]
+
+            if len(memory) >= 2:
+                # x86 only allows one memory operand so go through the scratch register
+                if instruction[0] == 'mov':
+                    output.append(('mov', SCRATCH, operands[1]))
+                    output.append(('mov', operands[0], SCRATCH))
+                else:
+                    destination = operands[0]
+                    output.append(('mov', SCRATCH, destination))
+                    output.append((instruction[0],) + tuple(SCRATCH if operand == destination else operand
+                                                            for operand in operands))
+                    output.append(('mov', destination, SCRATCH))
+            else:
+                output.append((instruction[0],) + tuple(operands))
+
+            # The prologue goes straight after the function's label
+            if instruction[0] == 'label' and not started:
+                output.extend(prologue)
+                started = True
+
+        return output
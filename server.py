@@ -0,0 +1,96 @@
+################################################# Server.py #################################################
+
+# A long running compile server
+#
+# Starting compiler.py costs python starting up, importing every module and
+# loading the lexer tables before any compiling is done. The server pays that
+# once and then listens on a unix socket for batches of sources from
+# client.py (see there for the format), replying with the assembly of each or
+# a diagnostic if it couldn't be compiled
+#
+# Usage: server.py [socket path]
+#
+# Each connection is handled on its own thread so many clients can be served
+# at once, the lexer tables and code cache are shared by all of them
+
+import sys, os, stat, json, socket, socketserver, traceback
+import compiler, tokenize
+from client import SOCKET_PATH
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+def compile_batch(message):
+    # The reply for a request
+    if not isinstance(message, dict) or not isinstance(message.get('files'), list):
+        raise TypeError('expected an object with a list of files')
+    optimize = message.get('optimize', True)
+    cache = message.get('cache', True)
+
+    results = []
+    for file in message['files']:
+        try:
+            asm = compiler.compile_source(file['source'], optimize, cache)
+            results.append({'name': file['name'], 'asm': asm})
+        except Exception as error:
+            # A bad source (the parser asserts) is reported rather than taking the server down
+            diagnostic = ''.join(traceback.format_exception_only(type(error), error)).strip()
+            results.append({'name': file['name'], 'error': diagnostic})
+    return {'results': results}
+
+
+class CompileHandler(socketserver.StreamRequestHandler):
+    # Answers each line of a connection
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                reply = compile_batch(json.loads(line))
+            except (ValueError, KeyError, TypeError) as error:
+                reply = {'error': 'Bad request: ' + str(error)}
+            self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class CompileServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def is_stale_socket(path):
+    # Is path a socket that no server is listening on (left by a server that
+    # didn't shut down)
+    if not stat.S_ISSOCK(os.lstat(path).st_mode):
+        return False
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(path)
+        except ConnectionRefusedError:
+            return True
+        except OSError:
+            return False
+    return False # a server is already running
+
+
+def serve(path=SOCKET_PATH):
+    # Loads everything that can be shared up front then serves forever
+
+    tokenize.getscanner()      # the lexer tables
+    compiler.get_code_cache()  # the code cache
+    compiler.compile_source('int main(){return 0;}', cache=False) # the rest of the compiler
+
+    if os.path.lexists(path):
+        assert is_stale_socket(path), 'Not starting, '+path+' is in use or is not a socket'
+        os.remove(path)
+
+    with CompileServer(path, CompileHandler) as server:
+        print('Compile server listening on', path)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    serve(sys.argv[1] if len(sys.argv) > 1 else SOCKET_PATH)
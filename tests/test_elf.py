@@ -0,0 +1,157 @@
+############################################### Test_ELF.py #################################################
+
+# Checks the object files written by elf.py (compiler.py -c)
+#
+# Usage: python tests/test_elf.py
+#
+# --> every instruction form the backend can make is encoded and compared byte
+#     for byte with what the GNU assembler makes for it (when as and objcopy
+#     are installed)
+# --> programs are compiled with compiler.py -c, linked with cc and run to
+#     check their exit status (when cc is installed)
+#
+# The compiler has modules called ast and tokenize which hide the standard
+# library's, so it is run as its own process and only elf.py is imported here
+# (with the repository at the end of sys.path so nothing else is hidden)
+
+import os, sys, shutil, subprocess, tempfile, unittest
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPOSITORY)
+
+import elf
+
+#-----------------------------------------------------------------------------------------------------------#
+
+# The instruction forms to check
+
+REGISTERS = ['eax', 'ecx', 'edx', 'ebx', 'esp', 'ebp', 'esi', 'edi']
+IMMEDIATES = ['0', '1', '-1', '127', '128', '-128', '-129', '100000', '-100000', '2147483647']
+MEMORY = ['dword [esp]', 'dword [esp+4]', 'dword [esp+200]', 'dword [ebp]', 'dword [ebp-8]',
+          'dword [eax]', 'dword [esi+12]', 'dword [edi-1000]']
+
+
+def instruction_forms():
+    # Every form of every instruction elf.encode supports
+    forms = [('ret',)]
+    for register in REGISTERS:
+        forms += [('push', register), ('pop', register)]
+    for op in elf.UNARY:
+        forms += [(op, operand) for operand in REGISTERS + MEMORY]
+    for op in ['mov'] + list(elf.ARITHMETIC):
+        for destination in REGISTERS:
+            forms += [(op, destination, source) for source in REGISTERS + IMMEDIATES + MEMORY]
+        for destination in MEMORY:
+            forms += [(op, destination, source) for source in REGISTERS + IMMEDIATES]
+    return forms
+
+
+REGISTERS_64 = {register: 'r' + register[1:] for register in REGISTERS}
+
+
+def gas(instruction):
+    # The instruction in GNU assembler intel syntax, as it runs in 64 bit mode
+    # (see the top of elf.py)
+    op, operands = instruction[0], list(instruction[1:])
+    wide = op in elf.ARITHMETIC and operands[0] == 'esp' # done on rsp
+    for i, operand in enumerate(operands):
+        if operand.startswith('dword'):
+            address = operand[operand.index('[')+1:operand.index(']')]
+            base = address.rstrip('+-0123456789')
+            operands[i] = ('qword' if wide else 'dword') + ' ptr [' + REGISTERS_64[base] \
+                          + address[len(base):] + ']'
+        elif operand in REGISTERS_64 and (wide or op in ('push', 'pop')):
+            operands[i] = REGISTERS_64[operand]
+    return op + ' ' + ', '.join(operands)
+
+
+def run(command, **options):
+    return subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **options)
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+@unittest.skipUnless(shutil.which('as') and shutil.which('objcopy'), 'needs the GNU assembler')
+class EncodingTest(unittest.TestCase):
+
+    def test_matches_assembler(self):
+        forms = instruction_forms()
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'forms.s')
+            with open(source, 'w') as f:
+                f.write('.intel_syntax noprefix\n.text\n')
+                for instruction in forms:
+                    f.write(gas(instruction) + '\n')
+            objectfile = os.path.join(directory, 'forms.o')
+            binary = os.path.join(directory, 'forms.bin')
+            result = run(['as', '--64', '-o', objectfile, source])
+            self.assertEqual(result.returncode, 0, result.stderr.decode())
+            run(['objcopy', '-O', 'binary', '--only-section=.text', objectfile, binary])
+            with open(binary, 'rb') as f:
+                expected = f.read()
+
+        # Compared one instruction at a time so a failure names the instruction
+        offset = 0
+        for instruction in forms:
+            code = elf.encode(instruction)
+            self.assertEqual(code.hex(), expected[offset:offset+len(code)].hex(),
+                             repr(instruction) + ' (' + gas(instruction) + ')')
+            offset += len(code)
+        self.assertEqual(offset, len(expected))
+
+
+@unittest.skipUnless(shutil.which('cc'), 'needs a C compiler to link')
+class ObjectFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def exit_status(self, source, *options):
+        # Compiles source with compiler.py -c, links it and returns its exit status
+        filename = os.path.join(self.directory, 'program.c')
+        with open(filename, 'w') as f:
+            f.write(source)
+        result = run([sys.executable, os.path.join(REPOSITORY, 'compiler.py'), '--no-cache', '-c']
+                     + list(options) + [filename], cwd=self.directory)
+        self.assertEqual(result.returncode, 0, result.stderr.decode())
+
+        program = os.path.join(self.directory, 'program')
+        result = run(['cc', '-o', program, os.path.join(self.directory, 'program.o')])
+        self.assertEqual(result.returncode, 0, result.stderr.decode())
+        return run([program]).returncode
+
+    def test_return_values(self):
+        for options in ([], ['-O0'], ['--stream']):
+            self.assertEqual(self.exit_status('int main(){return 42;}\n', *options), 42)
+            self.assertEqual(self.exit_status('int main(){return -~!-~5;}\n', *options), 1)
+            self.assertEqual(self.exit_status('int main(){return ~-12;}\n', *options), 11)
+            self.assertEqual(self.exit_status('int main(){return !0;}\n', *options), 1)
+
+    def test_many_functions(self):
+        # More code than the Emitter buffers at once, main last
+        functions = ['int f%d(){return -~!-%d;}\n' % (i, i) for i in range(2000)]
+        source = ''.join(functions) + 'int main(){return -~7;}\n'
+        for options in ([], ['-O0']):
+            self.assertEqual(self.exit_status(source, *options), 8)
+
+    def test_symbols(self):
+        # Every function gets a global FUNC symbol sized to the next one
+        code, symbols = elf.assemble([('section', '.text'), ('global', '_f'), ('label', '_f'),
+                                      ('mov', 'eax', '1'), ('ret',), ('global', '_main'),
+                                      ('label', '_main'), ('mov', 'eax', '2'), ('ret',)])
+        filename = os.path.join(self.directory, 'symbols.o')
+        with open(filename, 'wb') as f:
+            f.write(elf.object_file(code, symbols))
+        if shutil.which('nm'):
+            result = run(['nm', '-S', filename])
+            lines = sorted(result.stdout.decode().split('\n')[:-1])
+            self.assertEqual(lines, ['0000000000000000 0000000000000006 T f',
+                                     '0000000000000006 0000000000000006 T main'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+############################################### Test_Parsers.py ##############################################
+
+# Checks the expression parser (parsers.parse_expression) and the LL(1) parser
+# that calls it for <exp>
+#
+# Usage: python tests/test_parsers.py
+#
+# --> nested and mixed prefix operators give the right tree
+# --> made up infix operators are grouped by their binding powers
+# --> very deep expressions parse without running out of python stack
+#
+# Like test_elf.py the compiler's ast and tokenize modules would hide the
+# standard library's, so the parser is run in its own process from the
+# repository directory and prints what it built
+
+import os, sys, subprocess, textwrap, unittest
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def python(script):
+    # Runs script in the repository directory
+    return subprocess.run([sys.executable, '-c', textwrap.dedent(script)], cwd=REPOSITORY,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+def run_python(script):
+    # Runs script and returns the lines it printed
+    result = python(script)
+    assert result.returncode == 0, result.stderr.decode()
+    return result.stdout.decode().split('\n')[:-1]
+
+
+# Parses each argument with parse_expression, building the tree as a string
+# with every operator in brackets, eg. - ~ 5 -> (-(~5))
+# The tokens are split on spaces, ones made of digits are INTEGERs
+TOY_PARSER = '''
+import sys
+import definitions, parsers
+
+class Tokens:
+    def __init__(self, text):
+        self.tokens = text.split()
+        self.i = 0
+    def __next__(self):
+        self.i += 1
+        return self.tokens[self.i-1]
+    def peak(self):
+        return self.tokens[self.i] if self.i < len(self.tokens) else None
+    def peak_kind(self):
+        lexeme = self.peak()
+        return 'INTEGER' if lexeme is not None and lexeme.isdigit() else 'SYMBOL'
+
+BUILDERS = {'<exp>': lambda children: children[0] if len(children) == 1
+                                      else '(' + children[0] + children[1] + ')',
+            '<unary_op>': lambda children: children[0],
+            '<infix>': lambda children: '(' + ' '.join(children) + ')'}
+
+# + and * are left associative, ^ is right associative and binds more
+# tightly than the prefix operators
+definitions.INFIX_BINDING_POWER.update({'+': (10, 11), '*': (20, 21), '^': (41, 40)})
+
+for line in sys.argv[1:]:
+    tokens = []
+    genrt = Tokens(line)
+    tree = parsers.parse_expression(genrt, tokens, BUILDERS)
+    print(tree + '|' + str(genrt.peak()) + '|' + ' '.join(tokens))
+'''
+
+
+class ExpressionTest(unittest.TestCase):
+
+    def parse(self, *expressions):
+        # (tree, next token, tokens recorded) for each expression
+        return [tuple(line.split('|')) for line in run_python(
+                'import sys; sys.argv[1:] = ' + repr(list(expressions)) + '\n' + TOY_PARSER)]
+
+    def test_prefix(self):
+        self.assertEqual(self.parse('5 ;', '- 5 ;', '- ~ ! 5 ;', '! ! - - ~ ~ 0 ;'),
+                         [('5', ';', '5'),
+                          ('(-5)', ';', '- 5'),
+                          ('(-(~(!5)))', ';', '- ~ ! 5'),
+                          ('(!(!(-(-(~(~0))))))', ';', '! ! - - ~ ~ 0')])
+
+    def test_infix(self):
+        results = self.parse(
+            '1 + 2 * 3 ;', '1 * 2 + 3', '1 + 2 + 3', '1 * 2 * 3', '2 ^ 3 ^ 4',
+            '- 1 + 2', '- 1 * ~ 2', '- 2 ^ 3', '1 + - 2 ^ 3 * 4')
+        self.assertEqual(results[0], ('(1 + (2 * 3))', ';', '1 + 2 * 3'))
+        self.assertEqual([tree for tree, following, tokens in results],
+                         ['(1 + (2 * 3))',
+                          '((1 * 2) + 3)',
+                          '((1 + 2) + 3)',
+                          '((1 * 2) * 3)',
+                          '(2 ^ (3 ^ 4))',
+                          '((-1) + 2)',
+                          '((-1) * (~2))',
+                          '(-(2 ^ 3))',
+                          '(1 + ((-(2 ^ 3)) * 4))'])
+
+    def test_missing_operand(self):
+        result = python('import sys; sys.argv[1:] = ["- ;"]\n' + TOY_PARSER)
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn("Expected <int> but found ';'", result.stderr.decode())
+
+
+class FunctionTest(unittest.TestCase):
+
+    def test_expression_tree(self):
+        # The LL(1) parser hands <exp> to parse_expression
+        lines = run_python('''
+            import parsers, tokenize
+            genrt = tokenize.SourceTokenGenerator('int main(){return -~!12;}')
+            function = parsers.parse_function(genrt)
+            expression = function.statement.expression
+            while hasattr(expression, 'unary_op'):
+                print(expression.unary_op.operation)
+                expression = expression.expression
+            print(expression.value)
+            print(' '.join(function.tokens))
+            ''')
+        self.assertEqual(lines, ['-', '~', '!', '12', 'int main ( ) { return - ~ ! 12 ; }'])
+
+    def test_deep_expression(self):
+        lines = run_python('''
+            import parsers, tokenize
+            genrt = tokenize.SourceTokenGenerator('int main(){return ' + '-~' * 200000 + '5;}')
+            function = parsers.parse_function(genrt)
+            depth = 0
+            expression = function.statement.expression
+            while hasattr(expression, 'unary_op'):
+                depth += 1
+                expression = expression.expression
+            print(depth, expression.value, len(function.tokens))
+            ''')
+        self.assertEqual(lines, ['400000 5 400009'])
+
+
+if __name__ == '__main__':
+    unittest.main()
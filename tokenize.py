@@ -1,4 +1,8 @@
+import os, mmap
+from array import array
+
 import definitions
+import lexer
 
 def isidentifier(token):
     """ Decides whether a string is a valid identifier (for variable etc)"""
@@ -65,12 +69,291 @@ def gettokens(filename):
     return tokens
 
 
+class Scanner:
+    """ Splits source text into (kind, lexeme) tokens using the DFA tables built by lexer.py
+
+    At each position the DFA is run as far as it can go and the longest token
+    it accepted is taken (maximal munch), ties are broken by the order of the
+    expressions in lexer.language (the table accepts the first one) """
+
+    def __init__(self, table):
+        self.table = table
+        self.keys = table.keys
+
+        # Byte -> column translation so a whole buffer is converted in one go
+        self.translation = table.column_translation()
+
+        # Store each state as the offset of its row in the transition table so the
+        # inner loop doesn't have to multiply, -1 is still no transition
+        n_columns = table.n_columns
+        self.start = table.start * n_columns
+        self.transitions = [t * n_columns if t != -1 else -1 for t in table.transitions]
+
+        # accept indexed by row offset as well (only the row starts are used)
+        self.accept = [-1] * len(self.transitions)
+        for state in range(table.n_states):
+            if state * n_columns < len(self.accept):
+                self.accept[state * n_columns] = table.accept[state]
+
+        self.whitespace = frozenset(ord(char) for char in definitions.WHITESPACE)
+
+    def scan(self, data):
+        """ Returns a list of (kind, lexeme) for each token in data (a str or bytes) """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        return list(self.tokenstream(data))
+
+    def tokenstream(self, data):
+        """ Scans a whole bytes-like buffer (eg. bytes or mmap) into a TokenStream """
+        stream = TokenStream(data, self.keys)
+        self.scan_offsets(data, self.translate(data), True, stream.kinds, stream.starts, stream.ends)
+        return stream
+
+    def translate(self, data):
+        """ Returns the column of every byte in data """
+        if isinstance(data, bytes):
+            return data.translate(self.translation)
+
+        # Other buffers (mmap) are translated a block at a time so only one
+        # block is ever copied as bytes
+        columns = bytearray(len(data))
+        for i in range(0, len(data), 1<<20):
+            columns[i:i+(1<<20)] = data[i:i+(1<<20)].translate(self.translation)
+        return columns
+
+    def scan_buffer(self, data, final, offset=0):
+        """ Scans the bytes in data and returns the list of (kind, lexeme) tokens and how many bytes were used
+
+        If final is False more data is still to come so a token running into the
+        end of the buffer is left for the next call (it may continue). offset is
+        where the buffer starts in the file (for error messages) """
+        kinds, starts, ends = array('B'), array('l'), array('l')
+        consumed = self.scan_offsets(data, self.translate(data), final, kinds, starts, ends, offset)
+
+        keys = self.keys
+        tokens = [(keys[kinds[k]], data[starts[k]-offset:ends[k]-offset].decode('utf-8'))
+                  for k in range(len(kinds))]
+        return tokens, consumed
+
+    def scan_offsets(self, data, columns, final, kinds, starts, ends, offset=0):
+        """ The scanning loop, for each token appends the number of its kind (in
+        lexer.language) and where it starts and ends (plus offset) to the arrays
+        kinds, starts and ends. Returns how many bytes were used (see scan_buffer) """
+        transitions = self.transitions
+        accept = self.accept
+        whitespace = self.whitespace
+        start = self.start
+        add_kind = kinds.append
+        add_start = starts.append
+        add_end = ends.append
+
+        i = 0
+        n = len(data)
+        while i < n:
+            # Skip any whitespace between tokens
+            if data[i] in whitespace:
+                i += 1
+                continue
+
+            # Run the DFA from here remembering the last place it accepted
+            state = start
+            last_rule = -1
+            last_end = i
+            j = i
+            while j < n:
+                column = columns[j]
+                if column == 255: # Not a character in the language
+                    break
+                state = transitions[state + column]
+                if state == -1:
+                    break
+                j += 1
+                if accept[state] != -1:
+                    last_rule = accept[state]
+                    last_end = j
+
+            if j == n and not final:
+                # Ran out of buffer before the DFA stopped so the token might be longer
+                break
+
+            assert last_rule != -1, 'Unrecognised token at position '+str(offset+i)+': '+repr(bytes(data[i:i+10]))
+
+            add_kind(last_rule)
+            add_start(offset + i)
+            add_end(offset + last_end)
+            i = last_end
+
+        return i
+
+    def scan_file(self, f, chunk_size=1<<16):
+        """ Yields (kind, lexeme) tokens from a binary file object reading chunk_size bytes at a time """
+        pending = b'' # the unfinished end of the last chunk
+        offset = 0
+        while True:
+            chunk = f.read(chunk_size)
+            final = len(chunk) == 0
+            data = pending + chunk
+
+            tokens, consumed = self.scan_buffer(data, final, offset)
+            yield from tokens
+
+            if final:
+                return
+            pending = data[consumed:]
+            offset += consumed
+
+
+class LazyScanner(Scanner):
+    """ The same as Scanner but runs a lexer.LazyDFA, which works out its states
+    as the input reaches them, so nothing has to be built before scanning starts """
+
+    def __init__(self, dfa):
+        self.dfa = dfa
+        self.keys = dfa.keys
+        self.translation = dfa.column_translation()
+        self.whitespace = frozenset(ord(char) for char in definitions.WHITESPACE)
+
+    def scan_offsets(self, data, columns, final, kinds, starts, ends, offset=0):
+        """ See Scanner.scan_offsets """
+        dfa = self.dfa
+        transitions = dfa.transitions # emptied in place when the cache is flushed
+        accept = dfa.accept
+        whitespace = self.whitespace
+
+        i = 0
+        n = len(data)
+        while i < n:
+            # Skip any whitespace between tokens
+            if data[i] in whitespace:
+                i += 1
+                continue
+
+            if dfa.fallback:
+                # The cache was thrashing so run the NFA instead
+                last_rule, last_end, j = dfa.simulate(columns, i, n)
+
+            else:
+                # Run the DFA from here remembering the last place it accepted
+                state = dfa.start_state()
+                last_rule = -1
+                last_end = i
+                j = i
+                while j < n:
+                    column = columns[j]
+                    if column == 255: # Not a character in the language
+                        break
+                    next_state = transitions[state + column]
+                    if next_state == lexer.UNKNOWN:
+                        next_state = dfa.add_transition(state, column)
+                    if next_state == -1:
+                        break
+                    state = next_state
+                    j += 1
+                    if accept[state] != -1:
+                        last_rule = accept[state]
+                        last_end = j
+
+            if j == n and not final:
+                # Ran out of buffer before the DFA stopped so the token might be longer
+                break
+
+            assert last_rule != -1, 'Unrecognised token at position '+str(offset+i)+': '+repr(bytes(data[i:i+10]))
+
+            kinds.append(last_rule)
+            starts.append(offset + i)
+            ends.append(offset + last_end)
+            dfa.bytes_scanned += j - i
+            i = last_end
+
+        return i
+
+
+# The scanners are built the first time they are needed
+_scanners = {}
+
+def getscanner(mode='table'):
+    """ Returns the scanner for lexer.language, shared by every caller
+
+    mode='table' uses the cached minimal DFATable (built if the cache is stale)
+    mode='lazy' uses a LazyDFA so there is no start up cost """
+    if not mode in _scanners:
+        if mode == 'table':
+            _scanners[mode] = Scanner(lexer.get_tables())
+        else:
+            assert mode == 'lazy', 'Unknown scanner mode '+repr(mode)
+            _scanners[mode] = LazyScanner(lexer.LazyDFA(lexer.language))
+    return _scanners[mode]
+
+def scantokens(filename):
+    """ Returns a list of (kind, lexeme) tokens using the DFA scanner """
+    return list(readtokens(filename))
+
+def readtokens(filename, mode='table'):
+    """ Returns a TokenStream of the tokens in a file, the file is memory mapped
+    rather than read so it is never copied into python strings (see getscanner for mode) """
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            data = b'' # empty files can't be mapped
+        else:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    return getscanner(mode).tokenstream(data)
+
+
+class TokenStream:
+    """ A compact list of tokens over a source buffer
+
+    Rather than a string for every token, the kind (as its number in
+    lexer.language) and the start and end offsets into the buffer are kept
+    in three arrays. The lexeme only becomes a string when it is looked up """
+
+    def __init__(self, buffer, keys):
+        self.buffer = buffer
+        self.keys = keys
+        self.kinds = array('B')
+        self.starts = array('l')
+        self.ends = array('l')
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, i):
+        """ The lexeme of the i'th token (so the stream can be used like a list of lexemes) """
+        return self.lexeme(i)
+
+    def __iter__(self):
+        """ Iterates over (kind, lexeme) pairs """
+        for i in range(len(self.kinds)):
+            yield self.kind(i), self.lexeme(i)
+
+    def lexeme(self, i):
+        """ The text of the i'th token """
+        return self.buffer[self.starts[i]:self.ends[i]].decode('utf-8')
+
+    def kind(self, i):
+        """ The key (from lexer.language) of the i'th token """
+        return self.keys[self.kinds[i]]
+
+    def span(self, i):
+        """ The (start, end) offsets of the i'th token in the buffer """
+        return self.starts[i], self.ends[i]
+
+
 class TokenGenerator:
     # Creates a 'generator' that can be called on with next() but also has .peak() functionality to look ahead
 
-    def __init__(self, filename):
+    # backend='dfa' uses the table driven Scanner, backend='lazy' uses the LazyScanner
+    # and backend='chars' uses gettokens
+    def __init__(self, filename, backend='dfa'):
         # get tokens from file
-        self.tokens = gettokens(filename)
+        if backend == 'dfa':
+            self.tokens = readtokens(filename) # a TokenStream, indexes like a list of lexemes
+        elif backend == 'lazy':
+            self.tokens = readtokens(filename, 'lazy')
+        else:
+            assert backend == 'chars', 'Unknown tokenizer backend '+repr(backend)
+            self.tokens = gettokens(filename)
         self.i = 0
 
     # overload the next() method
@@ -89,4 +372,62 @@ class TokenGenerator:
         if self.i < len(self.tokens):
             return self.tokens[self.i]
         else:
-            return None
\ No newline at end of file
+            return None
+
+    # the kind (from lexer.language) of the token peak() returns
+    def peak_kind(self):
+        if self.i >= len(self.tokens):
+            return None
+        if isinstance(self.tokens, TokenStream):
+            return self.tokens.kind(self.i)
+        # gettokens only has the text so scan it again to find the kind
+        return getscanner().scan(self.tokens[self.i])[0][0]
+
+
+class SourceTokenGenerator(TokenGenerator):
+    # The same as TokenGenerator but for source text that is already in memory
+    # (a str or bytes) rather than a file
+
+    def __init__(self, source, backend='dfa'):
+        if isinstance(source, str):
+            source = source.encode('utf-8')
+        assert backend in ('dfa', 'lazy'), 'Unknown tokenizer backend '+repr(backend)
+        self.tokens = getscanner('table' if backend == 'dfa' else 'lazy').tokenstream(source)
+        self.i = 0
+
+
+class StreamTokenGenerator:
+    # The same as TokenGenerator but reads the file a chunk at a time and only
+    # scans tokens as they are asked for, so the whole file is never in memory
+
+    def __init__(self, filename, chunk_size=1<<16):
+        self.file = open(filename, 'rb')
+        self.scanned = getscanner().scan_file(self.file, chunk_size)
+        self.advance()
+
+    def advance(self):
+        # Read the next (kind, lexeme) into the look ahead
+        try:
+            self.lookahead = next(self.scanned)
+        except StopIteration:
+            self.lookahead = None
+            self.file.close()
+
+    # overload the next() method
+    def __next__(self):
+        if self.lookahead is None:
+            raise StopIteration
+        kind, value = self.lookahead
+        self.advance()
+        return value
+
+    # look one value ahead but don't move on
+    def peak(self):
+        if self.lookahead is None:
+            return None
+        return self.lookahead[1]
+
+    def peak_kind(self):
+        if self.lookahead is None:
+            return None
+        return self.lookahead[0]